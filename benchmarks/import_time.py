@@ -0,0 +1,62 @@
+"""
+Measures the time taken to import sc2_build_tokenizer in fresh interpreters,
+and exits with an error if the median import time is over budget.
+
+Usage: python benchmarks/import_time.py [--budget SECONDS] [--runs N]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+# importing the package shouldn't load the bundled datasets, the replay
+# parser or numpy, each of which takes longer than this on its own
+IMPORT_BUDGET = 0.05
+REPO_PATH = Path(__file__).resolve().parent.parent
+
+
+def measure_import_time(module='sc2_build_tokenizer'):
+    """
+    Returns the cumulative import time of a module in seconds,
+    as reported by python -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if name.strip() == module and cumulative.strip().isdigit():
+            return int(cumulative) / 1_000_000
+
+    raise RuntimeError(f'No import time recorded for {module}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--budget', type=float, default=IMPORT_BUDGET)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    times = [measure_import_time() for _ in range(args.runs)]
+    median = statistics.median(times)
+    print(json.dumps({
+        'benchmark': 'import_time',
+        'median': median,
+        'min': min(times),
+        'max': max(times),
+        'budget': args.budget,
+    }))
+
+    if median > args.budget:
+        sys.exit(f'Import took {median:.3f}s, over budget of {args.budget:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
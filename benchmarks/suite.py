@@ -0,0 +1,253 @@
+"""
+Benchmarks build extraction, token counting, token distributions and token
+path generation on synthetic corpora of increasing build length and size.
+
+Results are printed as JSON, or written to a file which later runs can be
+compared against to catch regressions between versions.
+
+Usage: python benchmarks/suite.py [--output PATH] [--compare PATH] [--tolerance RATIO] [--repeat N] [--quick]
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+from pathlib import Path
+from collections import defaultdict
+
+REPO_PATH = Path(__file__).resolve().parent.parent
+if str(REPO_PATH) not in sys.path:
+    sys.path.insert(0, str(REPO_PATH))
+
+from sc2_build_tokenizer import (  # noqa: E402
+    extract_builds,
+    generate_build_tokens,
+    generate_token_distributions,
+    generate_token_paths,
+    generate_optimal_token_path,
+)
+from synthetic import generate_corpus, generate_replays  # noqa: E402
+
+RESULTS_VERSION = 1
+
+# runs slower than the previous results by more than this ratio are regressions
+TOLERANCE = 1.5
+
+CORPUS_SIZES = [100, 400, 1600]
+BUILD_LENGTHS = [10, 20, 40]
+
+# every token path is generated, which grows exponentially with build length
+PATH_BUILD_LENGTHS = [6, 9, 12, 15]
+PATH_BUILDS = 20
+PATH_CORPUS_SIZE = 1000
+
+QUICK_CORPUS_SIZES = [50, 200]
+QUICK_BUILD_LENGTHS = [10, 20]
+QUICK_PATH_BUILD_LENGTHS = [6, 9]
+
+
+def measure(fn, repeat):
+    """
+    Returns the times taken by repeated calls to fn, and the last result
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def _record(benchmark, params, items, times, **extra):
+    return {
+        'benchmark': benchmark,
+        'params': params,
+        'items': items,
+        'runs': len(times),
+        'min': min(times),
+        'median': statistics.median(times),
+        'items_per_second': items / min(times) if min(times) else None,
+        **extra,
+    }
+
+
+def _count_tokens(corpus):
+    source = defaultdict(int)
+    for game in corpus:
+        for build in game:
+            source = generate_build_tokens(build.build, source)
+    return source
+
+
+def bench_extract_builds(corpus_sizes, build_length, repeat):
+    results = []
+    for games in corpus_sizes:
+        replays = generate_replays(generate_corpus(games, build_length))
+        times, _ = measure(lambda: extract_builds(replays), repeat)
+        results.append(_record(
+            'extract_builds',
+            {'games': games, 'build_length': build_length},
+            games,
+            times,
+        ))
+    return results
+
+
+def bench_generate_build_tokens(corpus_sizes, build_lengths, repeat):
+    results = []
+    for build_length in build_lengths:
+        for games in corpus_sizes:
+            corpus = generate_corpus(games, build_length)
+            times, source = measure(lambda: _count_tokens(corpus), repeat)
+            results.append(_record(
+                'generate_build_tokens',
+                {'games': games, 'build_length': build_length},
+                games * 2,
+                times,
+                tokens=len(source),
+            ))
+    return results
+
+
+def bench_generate_token_distributions(corpus_sizes, build_length, repeat):
+    results = []
+    for games in corpus_sizes:
+        source = _count_tokens(generate_corpus(games, build_length))
+        times, _ = measure(lambda: generate_token_distributions(source), repeat)
+        results.append(_record(
+            'generate_token_distributions',
+            {'games': games, 'build_length': build_length},
+            len(source),
+            times,
+        ))
+    return results
+
+
+def _tokenize_builds(tokenize, builds, distributions):
+    return [
+        tokenize(
+            build.build,
+            build.race,
+            None,
+            build.player,
+            build.max_collection_rate,
+            distributions.probability,
+            distributions.information,
+        )
+        for build in builds
+    ]
+
+
+def bench_generate_token_paths(build_lengths, repeat):
+    """
+    Tokenizes builds with distributions generated from a corpus of
+    the same builds, so every build has at least one token path
+    """
+    results = []
+    for build_length in build_lengths:
+        corpus = generate_corpus(PATH_CORPUS_SIZE, build_length)
+        distributions = generate_token_distributions(_count_tokens(corpus))
+        builds = [build for game in corpus for build in game][:PATH_BUILDS]
+
+        times, paths = measure(
+            lambda: _tokenize_builds(generate_token_paths, builds, distributions),
+            repeat,
+        )
+        results.append(_record(
+            'generate_token_paths',
+            {'builds': len(builds), 'build_length': build_length},
+            len(builds),
+            times,
+            paths=sum(map(len, paths)),
+        ))
+
+        times, _ = measure(
+            lambda: _tokenize_builds(generate_optimal_token_path, builds, distributions),
+            repeat,
+        )
+        results.append(_record(
+            'generate_optimal_token_path',
+            {'builds': len(builds), 'build_length': build_length},
+            len(builds),
+            times,
+        ))
+    return results
+
+
+def run(repeat=3, quick=False):
+    corpus_sizes = QUICK_CORPUS_SIZES if quick else CORPUS_SIZES
+    build_lengths = QUICK_BUILD_LENGTHS if quick else BUILD_LENGTHS
+    path_build_lengths = QUICK_PATH_BUILD_LENGTHS if quick else PATH_BUILD_LENGTHS
+
+    results = []
+    results.extend(bench_extract_builds(corpus_sizes, build_lengths[-1], repeat))
+    results.extend(bench_generate_build_tokens(corpus_sizes, build_lengths, repeat))
+    results.extend(bench_generate_token_distributions(corpus_sizes, build_lengths[-1], repeat))
+    results.extend(bench_generate_token_paths(path_build_lengths, repeat))
+
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def _result_key(result):
+    return result['benchmark'], tuple(sorted(result['params'].items()))
+
+
+def compare(previous, current, tolerance=TOLERANCE):
+    """
+    Returns the ratio of the current median time to the previous median
+    time of each benchmark in both results, and the benchmarks which
+    are slower by more than the tolerance
+    """
+    previous_results = {_result_key(result): result for result in previous['results']}
+
+    ratios = []
+    regressions = []
+    for result in current['results']:
+        previous_result = previous_results.get(_result_key(result))
+        if previous_result is None or not previous_result['median']:
+            continue
+
+        ratio = {
+            'benchmark': result['benchmark'],
+            'params': result['params'],
+            'ratio': result['median'] / previous_result['median'],
+        }
+        ratios.append(ratio)
+        if ratio['ratio'] > tolerance:
+            regressions.append(ratio)
+
+    return ratios, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--output', type=Path, help='write results to a file instead of printing them')
+    parser.add_argument('--compare', type=Path, help='results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='only run the smaller benchmarks')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.quick)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        previous = json.loads(args.compare.read_text())
+        ratios, regressions = compare(previous, results, args.tolerance)
+        print(json.dumps({'benchmark': 'compare', 'ratios': ratios}, indent=2))
+
+        if regressions:
+            sys.exit(f'{len(regressions)} benchmarks were over {args.tolerance}x slower than {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Generates synthetic corpora of builds for benchmarking, so benchmarks
+can run offline without replay files or the bundled datasets.
+
+Builds follow a random but fixed chain of likely next buildings for each
+race, so common sequences repeat across builds like real build orders do
+and the token distributions generated from a corpus have enough samples
+to tokenize builds from it.
+"""
+import random
+from types import SimpleNamespace
+
+from sc2_build_tokenizer.dataclasses import ParsedBuild
+from sc2_build_tokenizer.constants import IGNORE_OBJECTS
+
+RACE_BUILDINGS = {
+    'Protoss': [
+        'Nexus',
+        'Gateway',
+        'CyberneticsCore',
+        'WarpGate',
+        'TwilightCouncil',
+        'Forge',
+        'RoboticsFacility',
+        'RoboticsBay',
+        'Stargate',
+        'FleetBeacon',
+        'TemplarArchives',
+        'DarkShrine',
+    ],
+    'Terran': [
+        'CommandCenter',
+        'OrbitalCommand',
+        'PlanetaryFortress',
+        'Barracks',
+        'BarracksReactor',
+        'BarracksTechLab',
+        'Factory',
+        'FactoryTechLab',
+        'Starport',
+        'StarportReactor',
+        'EngineeringBay',
+        'Armory',
+    ],
+    'Zerg': [
+        'Hatchery',
+        'SpawningPool',
+        'Lair',
+        'RoachWarren',
+        'BanelingNest',
+        'EvolutionChamber',
+        'HydraliskDen',
+        'LurkerDenMP',
+        'Spire',
+        'InfestationPit',
+        'Hive',
+        'UltraliskCavern',
+    ],
+}
+
+# buildings that are recorded by the parser but removed when builds are extracted
+RACE_IGNORED_BUILDINGS = {
+    race: [building for building in IGNORE_OBJECTS if building in names]
+    for race, names in {
+        'Protoss': ['Pylon', 'Assimilator', 'PhotonCannon', 'ShieldBattery'],
+        'Terran': ['SupplyDepot', 'Refinery', 'Bunker', 'MissileTurret'],
+        'Zerg': ['Extractor', 'SpineCrawler', 'SporeCrawler', 'CreepTumor'],
+    }.items()
+}
+
+RACES = list(RACE_BUILDINGS)
+MAPS = ['Synthetic Plains LE', 'Synthetic Ridge LE', 'Synthetic Depths LE']
+
+# number of likely next buildings after each building
+BRANCHING = 3
+
+# gameloops between buildings, 22.4 gameloops per second
+MIN_INTERVAL = 150
+MAX_INTERVAL = 500
+
+
+def _race_transitions(seed):
+    """
+    Picks the likely next buildings after each building of each race
+    """
+    rng = random.Random(seed)
+    transitions = {}
+    for race, buildings in RACE_BUILDINGS.items():
+        transitions[race] = {
+            building: rng.sample(buildings, BRANCHING)
+            for building in buildings
+        }
+    return transitions
+
+
+def generate_build(race, build_length, rng, transitions):
+    """
+    Generates a list of (building, gameloop) tuples for a race
+    """
+    buildings = RACE_BUILDINGS[race]
+    building = buildings[0]
+    gameloop = 0
+    build = []
+
+    for _ in range(build_length):
+        gameloop += rng.randint(MIN_INTERVAL, MAX_INTERVAL)
+        build.append((building, gameloop))
+
+        # likely next buildings are weighted towards the first,
+        # with an occasional random building to vary the builds
+        if rng.random() < 0.1:
+            building = rng.choice(buildings)
+        else:
+            building = rng.choices(transitions[race][building], weights=[4, 2, 1])[0]
+
+    return build
+
+
+def generate_corpus(games, build_length, seed=0):
+    """
+    Generates games of 2 ParsedBuilds with build_length buildings each,
+    in the same format as extract_builds
+    """
+    rng = random.Random(seed)
+    transitions = _race_transitions(seed)
+
+    corpus = []
+    for game_index in range(games):
+        game_map = rng.choice(MAPS)
+        winner = rng.randint(1, 2)
+        game = []
+        for player_id in (1, 2):
+            race = rng.choice(RACES)
+            build = generate_build(race, build_length, rng, transitions)
+            game.append(ParsedBuild(
+                race,
+                f'Player {game_index}-{player_id}',
+                game_map,
+                build[-1][1] if build else 0,
+                rng.randint(1500, 3000),
+                winner == player_id,
+                build,
+            ))
+        corpus.append(game)
+
+    return corpus
+
+
+def _replay_object(name, gameloop, object_type):
+    return SimpleNamespace(
+        init_time=gameloop,
+        birth_time=gameloop + MIN_INTERVAL,
+        type=[object_type],
+        name_at_gameloop=lambda gameloop, name=name: name,
+    )
+
+
+def generate_replays(corpus, seed=0):
+    """
+    Converts games into objects with the attributes of parsed replays that
+    builds are extracted from, so extract_builds can be benchmarked without
+    parsing replay files.
+
+    Each player also has units and ignored buildings, which are filtered
+    out during extraction like they would be for a real replay
+    """
+    rng = random.Random(seed)
+    replays = []
+    for game in corpus:
+        players = {}
+        max_collection_rate = {}
+        winner = None
+        for player_id, build in enumerate(game, 1):
+            objects = []
+            for building, gameloop in build.build:
+                objects.append(_replay_object(building, gameloop, 'BUILDING'))
+                objects.append(_replay_object('Worker', gameloop + 1, 'UNIT'))
+                if rng.random() < 0.5:
+                    ignored = rng.choice(RACE_IGNORED_BUILDINGS[build.race])
+                    objects.append(_replay_object(ignored, gameloop + 2, 'BUILDING'))
+
+            players[player_id] = SimpleNamespace(
+                race=build.race,
+                name=build.player,
+                objects=dict(enumerate(objects)),
+            )
+            max_collection_rate[player_id] = build.max_collection_rate
+            if build.win:
+                winner = player_id
+
+        replays.append(SimpleNamespace(
+            players=players,
+            metadata={
+                'map': game[0].game_map,
+                'game_length': game[0].game_length,
+                'winner': winner,
+            },
+            summary={'max_collection_rate': max_collection_rate},
+        ))
+
+    return replays
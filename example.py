@@ -6,11 +6,18 @@ from collections import defaultdict
 
 from sc2_build_tokenizer import (
     extract_builds,
-    generate_build_tokens,
+    count_build_tokens,
     generate_token_distributions,
     generate_token_paths,
+    generate_optimal_token_path,
+    profile_pipeline,
 )
-from sc2_build_tokenizer.dataclasses import ParsedBuild, TokenizedBuild
+from sc2_build_tokenizer.corpus import BuildCorpus
+from sc2_build_tokenizer.scoring import score_corpus
+from sc2_build_tokenizer.model import TokenModel
+from sc2_build_tokenizer.clustering import cluster, condensed_distances, condensed_index
+from sc2_build_tokenizer.openers import OpenerIndex
+from sc2_build_tokenizer.dataclasses import ParsedBuild, TokenizedBuild, TokenDistributions
 from sc2_build_tokenizer.data import PARSED_BUILDS, TOKENIZED_BUILDS
 
 TEST_REPLAY_PATH = Path('replays/IEM/1 - Playoffs/Finals/Reynor vs Zest/20210228 - GAME 1 - Reynor vs Zest - Z vs P - Oxide LE.SC2Replay')
@@ -67,18 +74,7 @@ def manual_tokenize(
     # ----------------------
 
     if not _test:
-        for build in parsed_builds:
-            races = []
-            for player_build in build:
-                races.append(player_build.race)
-
-            for player_build in build:
-                player_race = player_build.race
-                opp_race = races[0] if races[1] == player_race else races[1]
-                BUILD_TOKENS[player_race][opp_race] = generate_build_tokens(
-                    player_build.build,
-                    BUILD_TOKENS[player_race][opp_race],
-                )
+        BUILD_TOKENS.update(count_build_tokens(parsed_builds))
 
     # -----------------------------
     # generate token distributions
@@ -98,6 +94,10 @@ def manual_tokenize(
             with open('sc2_build_tokenizer/data/token_information.py', 'w') as information:
                 information.write(f'TOKEN_INFORMATION = {to_dict(TOKEN_INFORMATION)}')
 
+            TokenModel.from_distributions(
+                TokenDistributions(TOKEN_PROBABILITY, TOKEN_INFORMATION),
+            ).save('sc2_build_tokenizer/data/token_model.bin')
+
     # ---------------------
     # generate token paths
     # ---------------------
@@ -119,7 +119,7 @@ def manual_tokenize(
 
                     opp_race = races[0] if races[1] == build.race else races[1]
 
-                    paths = generate_token_paths(
+                    optimal_path = generate_optimal_token_path(
                         build.build,
                         build.race,
                         opp_race,
@@ -128,7 +128,6 @@ def manual_tokenize(
                         TOKEN_PROBABILITY,
                         TOKEN_INFORMATION,
                     )
-                    optimal_path = paths[0]
                     game_builds.append(optimal_path)
                 tokenized_builds.append(game_builds)
                 print(f'Completed game {count + 1}')
@@ -164,53 +163,42 @@ def manual_tokenize(
     MIN_MINING_BASES = 0
     matchup = sorted([race1, race2])
     race = race1
-    opener = defaultdict(int)
+    opener_index = OpenerIndex()
     mu = 0
     macro = 0
-    for game in tokenized_builds:
+    for game, parsed_game in zip(tokenized_builds, parsed_builds):
+        opener_index.add_game(game, parsed_game)
+
         races = []
         for build in game:
             races.append(build.race)
         races.sort()
 
-        if races != matchup:
-            continue
-
-        mu += 1
-
-        for build in game:
-            if build.race == race and build.player == player:
-                print(build.player)
-                opening_build = []
-                mid_build = []
-                build_index = 0
-                total_buildings = 0
-                o_b = 0
-                while total_buildings < 4 and build_index < len(build.tokens):
-                    if o_b < 4:
-                        opening_build.append(build.tokens[build_index])
-                        o_b += len(build.tokens[build_index])
-                    else:
-                        mid_build.append(build.tokens[build_index])
-                        total_buildings += len(build.tokens[build_index])
-                    build_index += 1
-                # print(build.tokens, '\n')
-                opener[tuple(opening_build)] += 1
+        if races == matchup:
+            mu += 1
 
     print(f'{mu} games')
-    top_openers = sorted(list(opener.items()), key=lambda o: o[1], reverse=True)
+    top_openers = opener_index.openers(race1, race2, min_buildings=4, player=player)
     for o, c in top_openers:
         print(c, o)
 
     mu_builds = []
     build_information = []
+    corpus = BuildCorpus.from_games(parsed_builds)
+    build_scores = score_corpus(
+        corpus,
+        TOKEN_INFORMATION,
+        exclude=lambda building: 'Reactor' in building or 'TechLab' in building,
+    )
+    build_index = 0
     for game in parsed_builds:
         races = []
         for build in game:
             races.append(build.race)
 
         for build in game:
-            build_info = 0
+            build_info = float(build_scores.totals[build_index])
+            build_index += 1
             filtered_build = list(
                 map(
                     lambda x: x[0],
@@ -220,10 +208,7 @@ def manual_tokenize(
                     ),
                 )
             )
-            other_race = races[0] if build.race == races[1] else races[1]
             other_player = game[0].player if build.player == game[1].player else game[1].player
-            for building in filtered_build:
-                build_info += TOKEN_INFORMATION[build.race][other_race][(building,)]
             build_information.append((
                 # round(build_info / len(build.build), 2),
                 build_info,
@@ -342,77 +327,24 @@ def manual_tokenize(
 
         return compare_diff, comparison_weight, compare_values, s.ratio()
 
-    build_comparisons = {}
-    for build_id, build in enumerate(filtered_builds.keys()):
-        for other_id, other in enumerate(filtered_builds.keys()):
-            # same build
-            if build_id == other_id:
-                continue
-
-            compare_diff, comparison_weight, compare_values, ratio = compare_builds(build, other)
-            build_comparisons[tuple(sorted([build_id, other_id]))] = compare_diff
-
-    # print('Build Comparisons', len(build_comparisons))
-    # for c, b in build_comparisons:
-    #     print(c, b)
-
     build_list = list(filtered_builds.items())
-    build_clusters = {}
-    for build_id, build in enumerate(build_list):
-        build_clusters[build_id] = []
-
-    while True:
-        cluster_comparisons = {}
-        for (build_id, other_id), diff in build_comparisons.items():
-            if build_id in build_clusters and other_id in build_clusters:
-                cluster_comparisons[(build_id, other_id)] = diff
-
-        if not cluster_comparisons:
-            break
+    build_comparisons = condensed_distances(
+        [build for build, _ in build_list],
+        # the distance between two builds is how the later build compares to the earlier one
+        lambda build, other: compare_builds(other, build)[0],
+    )
 
-        sorted_comparisons = sorted(
-            cluster_comparisons.items(),
-            key=lambda build: build[1],
+    # each cluster is represented by its most common build
+    build_clusters = {}
+    if build_list:
+        clustering = cluster(
+            build_comparisons,
+            linkage='complete',
+            threshold=MAX_COMPARISON_DIFF,
         )
-
-        completed = False
-        for min_comparison_builds, min_comparison_diff in sorted_comparisons:
-            if min_comparison_diff > MAX_COMPARISON_DIFF:
-                break
-
-            # cross check cluster builds
-            cluster_complete_linkage = True
-            for build_id in min_comparison_builds:
-                other_comparison_id = min_comparison_builds[0] if min_comparison_builds[1] == build_id else min_comparison_builds[1]
-                for other_id in build_clusters[build_id]:
-                    cross_cluster_diff = build_comparisons[tuple(sorted([other_comparison_id, other_id]))]
-                    if cross_cluster_diff > MAX_COMPARISON_DIFF:
-                        # print(other_comparison_id, other_id, cross_cluster_diff)
-                        cluster_complete_linkage = False
-                        break
-
-                if not cluster_complete_linkage:
-                    break
-
-            if not cluster_complete_linkage:
-                continue
-
-            max_build_count = -1
-            max_build_id = None
-            for build_id in min_comparison_builds:
-                if build_list[build_id][1] > max_build_count:
-                    max_build_count = build_list[build_id][1]
-                    max_build_id = build_id
-
-            other_build_id = min_comparison_builds[0] if min_comparison_builds[1] == max_build_id else min_comparison_builds[1]
-            build_clusters[max_build_id].extend(build_clusters[other_build_id])
-            build_clusters[max_build_id].append(other_build_id)
-            del build_clusters[other_build_id]
-            completed = True
-            break
-
-        if not completed:
-            break
+        for clustered in clustering.clusters:
+            max_build_id = max(clustered, key=lambda build_id: build_list[build_id][1])
+            build_clusters[max_build_id] = [build_id for build_id in clustered if build_id != max_build_id]
 
     print('\n')
     all_builds = 0
@@ -436,7 +368,7 @@ def manual_tokenize(
         print('     ', build_list[build_id])
         print('-----')
         for other_id in clustered:
-            print(round(build_comparisons[tuple(sorted([build_id, other_id]))], 3), build_list[other_id])
+            print(round(build_comparisons[condensed_index(len(build_list), build_id, other_id)], 3), build_list[other_id])
         print('\n')
 
     print(unique_total, cluster_total)
@@ -493,18 +425,15 @@ def manual_tokenize(
             print(paths[0])
 
 
-# import cProfile
-# import re
-# cProfile.run('''
-manual_tokenize(
-    _test=False,
-    _write_builds=False,
-    _write_distributions=False,
-    _write_tokenized=False,
-)
-# ''', 'restats')
+# profiles each stage of tokenizing the replays instead of running the analysis
+PROFILE_PIPELINE = False
 
-# import pstats
-# from pstats import SortKey
-# p = pstats.Stats('restats')
-# p.strip_dirs().sort_stats(SortKey.CUMULATIVE).print_stats()
+if PROFILE_PIPELINE:
+    profile_pipeline(REPLAY_PATH, report_path='pipeline_profile.json')
+else:
+    manual_tokenize(
+        _test=False,
+        _write_builds=False,
+        _write_distributions=False,
+        _write_tokenized=False,
+    )
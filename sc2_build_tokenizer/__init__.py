@@ -1,49 +1,100 @@
 import logging
 from logging import NullHandler
 
-from sc2_build_tokenizer.parse import extract_builds
+from sc2_build_tokenizer.lazy import lazy_attributes
+from sc2_build_tokenizer.parse import extract_builds, iter_builds, replay_paths
 from sc2_build_tokenizer.tokenize import (
     generate_build_tokens,
     generate_token_distributions,
     generate_token_paths,
+    generate_optimal_token_path,
+    iter_token_paths,
+    create_fragment_cache,
 )
+from sc2_build_tokenizer.cache import FragmentCache
+from sc2_build_tokenizer.metrics import METRICS, Metrics
+from sc2_build_tokenizer.model import TokenModel, Vocabulary
 from sc2_build_tokenizer.dataclasses import (
     ParsedBuild,
     TokenizedBuild,
     TokenDistributions,
 )
 
-logging.getLogger('zephyrus_sc2_parser').setLevel(logging.ERROR)
-logger = logging.getLogger(__name__).addHandler(NullHandler())
-
+# everything else is imported when it's first used, to keep package imports fast
+LAZY_EXPORTS = {
+    'count_build_tokens': 'sc2_build_tokenizer.counting',
+    'merge_token_counts': 'sc2_build_tokenizer.counting',
+    'train_token_distributions': 'sc2_build_tokenizer.counting',
+    'TokenCounts': 'sc2_build_tokenizer.counting',
+    'IncrementalDistributions': 'sc2_build_tokenizer.incremental',
+    'tokenize_games': 'sc2_build_tokenizer.batch',
+    'PipelineProfiler': 'sc2_build_tokenizer.profiling',
+    'profile_pipeline': 'sc2_build_tokenizer.profiling',
+    'Pipeline': 'sc2_build_tokenizer.pipeline',
+    'ReplayCache': 'sc2_build_tokenizer.replay_cache',
+    'CorpusStore': 'sc2_build_tokenizer.store',
+    'BuildCorpus': 'sc2_build_tokenizer.corpus',
+    'BuildView': 'sc2_build_tokenizer.corpus',
+    'TokenizedCorpus': 'sc2_build_tokenizer.tokenized',
+    'TokenizedView': 'sc2_build_tokenizer.tokenized',
+    'BuildScores': 'sc2_build_tokenizer.scoring',
+    'score_corpus': 'sc2_build_tokenizer.scoring',
+    'BuildIndex': 'sc2_build_tokenizer.similarity',
+    'cluster': 'sc2_build_tokenizer.clustering',
+    'cluster_items': 'sc2_build_tokenizer.clustering',
+    'condensed_distances': 'sc2_build_tokenizer.clustering',
+    'OpenerIndex': 'sc2_build_tokenizer.openers',
+    'write_builds': 'sc2_build_tokenizer.serialize',
+    'read_builds': 'sc2_build_tokenizer.serialize',
+    'write_tokenized_builds': 'sc2_build_tokenizer.serialize',
+    'read_tokenized_builds': 'sc2_build_tokenizer.serialize',
+    'write_distributions': 'sc2_build_tokenizer.serialize',
+    'read_distributions': 'sc2_build_tokenizer.serialize',
+    'load_distributions': 'sc2_build_tokenizer.serialize',
+}
 
-def tokenize(replay):
-    logger.info('Tokenizing builds with default distributions')
+__getattr__, __dir__ = lazy_attributes(globals(), LAZY_EXPORTS)
 
-    logger.info('Extracting builds from replays')
-    games = extract_builds(replay)
+__all__ = [
+    'extract_builds',
+    'iter_builds',
+    'replay_paths',
+    'generate_build_tokens',
+    'generate_token_distributions',
+    'generate_token_paths',
+    'generate_optimal_token_path',
+    'iter_token_paths',
+    'create_fragment_cache',
+    'FragmentCache',
+    'METRICS',
+    'Metrics',
+    'TokenModel',
+    'Vocabulary',
+    'ParsedBuild',
+    'TokenizedBuild',
+    'TokenDistributions',
+    'tokenize',
+    *LAZY_EXPORTS,
+]
 
-    logger.info('Iterating through replays')
+logging.getLogger('zephyrus_sc2_parser').setLevel(logging.ERROR)
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
 
-    tokenized = []
-    for game in games:
-        races = []
-        for build in game:
-            races.append(build.race)
 
-        logger.info('Generating token paths for builds from current replay')
+def tokenize(replay, workers=None):
+    from sc2_build_tokenizer.batch import tokenize_games
 
-        builds = []
-        for build in game:
-            player_race = build.race
-            opp_race = races[0] if races[1] == player_race else races[1]
-            paths = generate_token_paths(build.build, player_race, opp_race)
+    logger.info('Tokenizing builds with default distributions')
 
-            # only take the most likely path
-            builds.append(paths[0])
+    # replays are parsed before tokenizing rather than streamed, so
+    # only one pool of workers runs at a time
+    logger.info('Extracting builds from replays')
+    games = extract_builds(replay, workers=workers)
 
-        tokenized.append(builds)
-        logger.info('Completed generating tokenized builds from current replay')
+    # only take the most likely path
+    logger.info('Generating optimal token paths for builds from replays')
+    tokenized = list(tokenize_games(games, workers=workers))
 
     logger.info('Completed generating all tokenized builds from replays')
 
@@ -0,0 +1,3 @@
+from sc2_build_tokenizer.cli import main
+
+main()
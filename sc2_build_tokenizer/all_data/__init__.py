@@ -1,4 +1,7 @@
-from sc2_build_tokenizer.data.parsed_builds import PARSED_BUILDS
-from sc2_build_tokenizer.data.tokenized_builds import TOKENIZED_BUILDS
-from sc2_build_tokenizer.data.token_information import TOKEN_INFORMATION
-from sc2_build_tokenizer.data.token_probability import TOKEN_PROBABILITY
+from sc2_build_tokenizer.lazy import lazy_attributes
+from sc2_build_tokenizer.data import DATASETS
+
+# re-exports the datasets of sc2_build_tokenizer.data, loaded when first accessed
+__getattr__, __dir__ = lazy_attributes(globals(), DATASETS)
+
+__all__ = list(DATASETS)
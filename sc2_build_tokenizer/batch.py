@@ -0,0 +1,106 @@
+import logging
+from itertools import repeat
+
+from sc2_build_tokenizer.pool import map_ordered, chunk
+from sc2_build_tokenizer.tokenize import (
+    create_fragment_cache,
+    generate_optimal_token_path,
+)
+
+logger = logging.getLogger(__name__)
+
+# model and fragment caches of the current worker process,
+# set once by the pool initializer instead of sent with each task
+WORKER_STATE = {
+    'model': None,
+    'caches': {},
+}
+
+
+def _init_worker(model):
+    WORKER_STATE['model'] = model
+    WORKER_STATE['caches'] = {}
+
+
+def _tokenize_game(game, max_token_size, model, caches):
+    races = []
+    for build in game:
+        races.append(build.race)
+
+    tokenized_builds = []
+    for build in game:
+        player_race = build.race
+        opp_race = races[0] if races[1] == player_race else races[1]
+
+        # without a model, each matchup shares a fragment cache of the default distributions
+        cache = None
+        if model is None:
+            if (player_race, opp_race) not in caches:
+                caches[(player_race, opp_race)] = create_fragment_cache(player_race, opp_race)
+            cache = caches[(player_race, opp_race)]
+
+        tokenized_builds.append(generate_optimal_token_path(
+            build.build,
+            player_race,
+            opp_race,
+            build.player,
+            build.max_collection_rate,
+            max_token_size=max_token_size,
+            cache=cache,
+            model=model,
+        ))
+
+    return tokenized_builds
+
+
+def _tokenize_chunk(games, max_token_size):
+    return [
+        _tokenize_game(
+            game,
+            max_token_size,
+            WORKER_STATE['model'],
+            WORKER_STATE['caches'],
+        )
+        for game in games
+    ]
+
+
+def tokenize_games(
+    games,
+    *,
+    model=None,
+    workers=None,
+    chunksize=64,
+    max_token_size=4,
+):
+    """
+    Lazily generates the optimal token path of each build in a list or
+    stream of games, yielding a list of tokenized builds for each game in
+    the same order as the games. Builds that can't be tokenized are None.
+
+    If workers is set, chunks of chunksize games are tokenized in a pool of
+    processes. The model is sent to each worker once when it starts rather
+    than with every chunk, and a model loaded from a file is memory-mapped
+    by each worker so they share its pages. Without a model, the default
+    distributions are used.
+    """
+    logger.info('Tokenizing games')
+
+    if not workers:
+        caches = {}
+        for game in games:
+            yield _tokenize_game(game, max_token_size, model, caches)
+        return
+
+    logger.info(f'Tokenizing games with {workers} workers')
+    for tokenized_chunk in map_ordered(
+        _tokenize_chunk,
+        chunk(games, chunksize),
+        repeat(max_token_size),
+        workers=workers,
+        initializer=_init_worker,
+        initargs=(model,),
+    ):
+        yield from tokenized_chunk
+
+    logger.info('Completed tokenizing games')
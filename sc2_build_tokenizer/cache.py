@@ -0,0 +1,119 @@
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from sc2_build_tokenizer.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class FragmentCache:
+    """
+    Thread-safe LRU cache of token fragment values for a single matchup.
+
+    A fragment is the product of the conditional probabilities and the
+    sum of the information of every prefix of a token, along with the
+    individual values for each building in the token.
+    """
+
+    def __init__(
+        self,
+        token_probability,
+        token_information,
+        *,
+        player_race=None,
+        opp_race=None,
+        maxsize=4096,
+    ):
+        self.token_probability = token_probability
+        self.token_information = token_information
+        self.player_race = player_race
+        self.opp_race = opp_race
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._recorded_hits = 0
+        self._recorded_misses = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def is_for(self, token_probability, token_information):
+        return (
+            self.token_probability is token_probability
+            and self.token_information is token_information
+        )
+
+    def fragment(self, token):
+        """
+        Returns the probability, information, probability values and
+        information values of a token, calculating them from the
+        longest cached prefix of the token if needed
+        """
+        with self._lock:
+            if token in self._fragments:
+                self.hits += 1
+                self._fragments.move_to_end(token)
+                return self._fragments[token]
+
+            self.misses += 1
+
+            if len(token) == 1:
+                prefix_fragment = (1, 0, (), ())
+            else:
+                prefix_fragment = self.fragment(token[:-1])
+
+            (
+                prefix_probability,
+                prefix_information,
+                prefix_probability_values,
+                prefix_information_values,
+            ) = prefix_fragment
+
+            probability = self.token_probability[token]
+            information = self.token_information[token]
+            token_fragment = (
+                prefix_probability * probability,
+                prefix_information + information,
+                prefix_probability_values + (probability,),
+                prefix_information_values + (information,),
+            )
+
+            self._fragments[token] = token_fragment
+            if self.maxsize is not None and len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+
+            return token_fragment
+
+    def record_metrics(self):
+        """
+        Records the hits and misses since they were last recorded in METRICS,
+        so the shared metrics aren't updated for every lookup
+        """
+        with self._lock:
+            hits = self.hits - self._recorded_hits
+            misses = self.misses - self._recorded_misses
+            self._recorded_hits = self.hits
+            self._recorded_misses = self.misses
+
+        if METRICS.enabled:
+            METRICS.increment('fragment_cache_hits', hits)
+            METRICS.increment('fragment_cache_misses', misses)
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._fragments))
+
+    def clear(self):
+        with self._lock:
+            logger.debug(f'Clearing {len(self._fragments)} cached fragments')
+            self.record_metrics()
+            self._fragments.clear()
+            self.hits = 0
+            self.misses = 0
+            self._recorded_hits = 0
+            self._recorded_misses = 0
@@ -0,0 +1,80 @@
+"""
+Runs the stages of the build tokenization pipeline, storing the artifacts of
+each stage in an output directory. Stages whose inputs haven't changed are
+skipped, and interrupted stages resume where they left off.
+
+Usage: python -m sc2_build_tokenizer {run,parse,count,distributions,tokenize} --output DIR [options]
+"""
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+from sc2_build_tokenizer.parse import SEVEN_MINUTES
+from sc2_build_tokenizer.pipeline import Pipeline, StageInputError, STAGES
+
+logger = logging.getLogger(__name__)
+
+
+def _add_stage_arguments(parser, stages):
+    parser.add_argument('--output', '-o', type=Path, required=True, help='directory to store artifacts in')
+    parser.add_argument('--workers', '-w', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--force', action='store_true', help='run stages even if their inputs are unchanged')
+    parser.add_argument('--verbose', '-v', action='store_true')
+
+    if 'parse' in stages:
+        parser.add_argument('replays', type=Path, help='replay file or directory of replays')
+        parser.add_argument('--end', type=int, default=SEVEN_MINUTES, help='last gameloop of builds')
+    if 'count' in stages:
+        parser.add_argument('--shard-size', type=int, default=1000, help='games counted in each shard')
+        parser.add_argument('--count-token-size', type=int, default=8, help='largest token counted')
+    if 'tokenize' in stages:
+        parser.add_argument('--path-token-size', type=int, default=4, help='largest token in token paths')
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m sc2_build_tokenizer',
+        description=__doc__.splitlines()[1],
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    _add_stage_arguments(commands.add_parser('run', help='run every stage'), STAGES)
+    for stage in STAGES:
+        _add_stage_arguments(commands.add_parser(stage, help=f'run the {stage} stage'), [stage])
+
+    return parser
+
+
+def run_stages(args, stages):
+    pipeline = Pipeline(args.output, workers=args.workers, force=args.force)
+
+    for stage in stages:
+        if stage == 'parse':
+            pipeline.parse(args.replays, args.end)
+        elif stage == 'count':
+            pipeline.count(args.shard_size, args.count_token_size)
+        elif stage == 'distributions':
+            pipeline.distributions()
+        elif stage == 'tokenize':
+            pipeline.tokenize(args.path_token_size)
+
+    return pipeline
+
+
+def main(argv=None):
+    args = _create_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+    )
+
+    stages = STAGES if args.command == 'run' else [args.command]
+    try:
+        pipeline = run_stages(args, stages)
+    except StageInputError as error:
+        sys.exit(str(error))
+
+    for stage in stages:
+        record = pipeline.manifest['stages'][stage]
+        print(f'{stage}: {record["items"]} items -> {pipeline.path(record["artifact"])}')
@@ -0,0 +1,160 @@
+import math
+import heapq
+import logging
+from array import array
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+LINKAGES = ['single', 'complete', 'average']
+
+# clusters are lists of item indexes, labels are the cluster of each item
+# and merges are (cluster, other cluster, distance) in the order they merged
+Clustering = namedtuple('Clustering', ['clusters', 'labels', 'merges'])
+
+
+def condensed_index(n, i, j):
+    """
+    Returns the index of the distance between items i and j in
+    a condensed distance array of n items
+    """
+    if i > j:
+        i, j = j, i
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def condensed_distances(items, distance):
+    """
+    Calculates the distance between every pair of items, stored as the
+    upper triangle of the distance matrix in a flat array
+    """
+    n = len(items)
+    distances = array('d')
+    for i in range(n):
+        for j in range(i + 1, n):
+            distances.append(distance(items[i], items[j]))
+    return distances
+
+
+def _item_count(distances):
+    n = (1 + math.isqrt(1 + 8 * len(distances))) // 2
+    if n * (n - 1) // 2 != len(distances):
+        raise ValueError(f'{len(distances)} distances is not a condensed distance array')
+    return n
+
+
+def _linkage_distance(linkage, distance, other_distance, size, other_size):
+    """
+    Lance-Williams update of the distance from a merged cluster to
+    another cluster, given the distances from each merged cluster
+    """
+    if linkage == 'single':
+        return min(distance, other_distance)
+    if linkage == 'complete':
+        return max(distance, other_distance)
+    return (size * distance + other_size * other_distance) / (size + other_size)
+
+
+def cluster(distances, *, linkage='complete', threshold=None):
+    """
+    Agglomerative clustering of items from a condensed distance array.
+
+    The closest pair of clusters is repeatedly merged until no clusters
+    are within threshold of each other, or everything is in one cluster
+    if there's no threshold. Pairs are kept in a priority queue and the
+    distances from merged clusters are updated incrementally rather than
+    recalculated from their items.
+
+    With complete linkage, every pair of items in a cluster is within
+    threshold. With single linkage, items are clustered if they're
+    connected by a chain of items within threshold. Average linkage
+    uses the mean distance between the items of two clusters
+    """
+    if linkage not in LINKAGES:
+        raise ValueError(f'Unknown linkage {linkage}, expected one of {LINKAGES}')
+
+    # distances are updated in place, so they're copied to keep the input intact
+    distances = array('d', distances)
+    n = _item_count(distances)
+    logger.info(f'Clustering {n} items with {linkage} linkage')
+
+    active = [True] * n
+    sizes = [1] * n
+    members = [[item] for item in range(n)]
+
+    # the distance between i < j is at row_offsets[i] + j
+    row_offsets = [condensed_index(n, i, i + 1) - (i + 1) for i in range(n)]
+
+    # entries are stale once either cluster has merged
+    # since the entry was added, which versions track
+    versions = [0] * n
+    queue = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            distance = distances[row_offsets[i] + j]
+            if threshold is None or distance <= threshold:
+                queue.append((distance, i, j, 0, 0))
+    heapq.heapify(queue)
+
+    merges = []
+    while queue:
+        distance, i, j, version, other_version = heapq.heappop(queue)
+        if (
+            not active[i]
+            or not active[j]
+            or versions[i] != version
+            or versions[j] != other_version
+        ):
+            continue
+
+        # the merged cluster takes the place of i
+        merges.append((i, j, distance))
+        active[j] = False
+        members[i].extend(members[j])
+        members[j] = None
+        versions[i] += 1
+
+        for k in range(n):
+            if not active[k] or k == i:
+                continue
+
+            index = row_offsets[i] + k if i < k else row_offsets[k] + i
+            other_index = row_offsets[j] + k if j < k else row_offsets[k] + j
+            updated = _linkage_distance(
+                linkage,
+                distances[index],
+                distances[other_index],
+                sizes[i],
+                sizes[j],
+            )
+            distances[index] = updated
+
+            if threshold is None or updated <= threshold:
+                a, b = (i, k) if i < k else (k, i)
+                heapq.heappush(queue, (updated, a, b, versions[a], versions[b]))
+
+        sizes[i] += sizes[j]
+
+    clusters = [sorted(cluster_members) for cluster_members in members if cluster_members is not None]
+    labels = [None] * n
+    for label, cluster_members in enumerate(clusters):
+        for item in cluster_members:
+            labels[item] = label
+
+    logger.info(f'Merged {n} items into {len(clusters)} clusters')
+
+    return Clustering(clusters, labels, merges)
+
+
+def cluster_items(items, distance, *, linkage='complete', threshold=None):
+    """
+    Clusters items, such as builds, by a distance function
+    """
+    if not items:
+        return Clustering([], [], [])
+
+    return cluster(
+        condensed_distances(items, distance),
+        linkage=linkage,
+        threshold=threshold,
+    )
@@ -0,0 +1,96 @@
+import sys
+import struct
+import logging
+from array import array
+
+from sc2_build_tokenizer.model import (
+    BYTE_ORDERS,
+    Vocabulary,
+    _align,
+    _pack_string,
+    _unpack_string,
+)
+
+logger = logging.getLogger(__name__)
+
+# columnar files are laid out as:
+#   header: magic, version, byte order, vocabularies, column index
+#   columns: the bytes of each array, aligned to 8 bytes
+HEADER_FORMAT = '<8sIB'
+
+
+def save_columns(path, magic, version, vocabularies, columns):
+    """
+    Writes named vocabularies and arrays to a binary file
+    """
+    header = bytearray(struct.pack(HEADER_FORMAT, magic, version, BYTE_ORDERS[sys.byteorder]))
+
+    header += struct.pack('<I', len(vocabularies))
+    for name, vocabulary in vocabularies.items():
+        header += _pack_string(name)
+        header += struct.pack('<I', len(vocabulary))
+        for value in vocabulary.names:
+            header += _pack_string(value)
+
+    header += struct.pack('<I', len(columns))
+    for name, column in columns.items():
+        header += _pack_string(name)
+        header += struct.pack('<cQ', column.typecode.encode('ascii'), len(column))
+
+    with open(path, 'wb') as columns_file:
+        columns_file.write(header)
+        for column in columns.values():
+            columns_file.write(bytes(_align(columns_file.tell()) - columns_file.tell()))
+            columns_file.write(column.tobytes())
+
+
+def load_columns(path, magic, version):
+    """
+    Reads the vocabularies and arrays written by save_columns. Each array
+    is copied out of the file in one go rather than value by value
+    """
+    with open(path, 'rb') as columns_file:
+        buffer = memoryview(columns_file.read())
+
+    file_magic, file_version, byte_order = struct.unpack_from(HEADER_FORMAT, buffer, 0)
+    if file_magic != magic:
+        raise ValueError(f'Unexpected file type {file_magic!r}: {path}')
+    if file_version != version:
+        raise ValueError(f'Unsupported file version {file_version}: {path}')
+
+    offset = struct.calcsize(HEADER_FORMAT)
+    vocabularies = {}
+    vocabulary_count, = struct.unpack_from('<I', buffer, offset)
+    offset += 4
+    for _ in range(vocabulary_count):
+        name, offset = _unpack_string(buffer, offset)
+        size, = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        vocabulary = Vocabulary()
+        for _ in range(size):
+            value, offset = _unpack_string(buffer, offset)
+            vocabulary.intern(value)
+        vocabularies[name] = vocabulary
+
+    index = []
+    column_count, = struct.unpack_from('<I', buffer, offset)
+    offset += 4
+    for _ in range(column_count):
+        name, offset = _unpack_string(buffer, offset)
+        typecode, length = struct.unpack_from('<cQ', buffer, offset)
+        offset += struct.calcsize('<cQ')
+        index.append((name, typecode.decode('ascii'), length))
+
+    swap = byte_order != BYTE_ORDERS[sys.byteorder]
+    columns = {}
+    for name, typecode, length in index:
+        offset = _align(offset)
+        column = array(typecode)
+        size = length * column.itemsize
+        column.frombytes(buffer[offset:offset + size])
+        if swap:
+            column.byteswap()
+        columns[name] = column
+        offset += size
+
+    return vocabularies, columns
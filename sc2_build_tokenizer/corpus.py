@@ -0,0 +1,206 @@
+import logging
+from array import array
+from dataclasses import dataclass
+
+from sc2_build_tokenizer.model import Vocabulary
+from sc2_build_tokenizer.dataclasses import ParsedBuild
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BuildView:
+    """
+    Row view of a build stored in a BuildCorpus. Columns are read from
+    the corpus when they're accessed, and building ids and gameloops
+    are memoryviews of the corpus arrays rather than copies
+    """
+    __slots__ = ('corpus', 'index')
+
+    corpus: 'BuildCorpus'
+    index: int
+
+    @property
+    def race(self):
+        return self.corpus.races.names[self.corpus.race_ids[self.index]]
+
+    @property
+    def player(self):
+        return self.corpus.players.names[self.corpus.player_ids[self.index]]
+
+    @property
+    def game_map(self):
+        return self.corpus.maps.names[self.corpus.map_ids[self.index]]
+
+    @property
+    def game_length(self):
+        return self.corpus.game_lengths[self.index]
+
+    @property
+    def max_collection_rate(self):
+        return self.corpus.max_collection_rates[self.index]
+
+    @property
+    def win(self):
+        return bool(self.corpus.wins[self.index])
+
+    @property
+    def building_ids(self):
+        start, end = self.corpus.build_bounds(self.index)
+        return memoryview(self.corpus.building_ids)[start:end]
+
+    @property
+    def gameloops(self):
+        start, end = self.corpus.build_bounds(self.index)
+        return memoryview(self.corpus.gameloops)[start:end]
+
+    @property
+    def buildings(self):
+        return self.corpus.vocabulary.decode(self.building_ids)
+
+    @property
+    def build(self):
+        return list(zip(self.buildings, self.gameloops))
+
+    def __len__(self):
+        start, end = self.corpus.build_bounds(self.index)
+        return end - start
+
+    def to_parsed_build(self):
+        return ParsedBuild(
+            self.race,
+            self.player,
+            self.game_map,
+            self.game_length,
+            self.max_collection_rate,
+            self.win,
+            self.build,
+        )
+
+
+class BuildCorpus:
+    """
+    Columnar store of a corpus of builds.
+
+    The buildings of every build are interned as ids and stored with
+    their gameloops in flat arrays, with the buildings of build i from
+    build_offsets[i] to build_offsets[i + 1]. Games are stored the same
+    way, as offsets into the builds. Metadata is stored as a column per
+    field, with strings interned by a vocabulary for each column.
+
+    Builds are converted to and from ParsedBuilds on demand
+    """
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self.races = Vocabulary()
+        self.players = Vocabulary()
+        self.maps = Vocabulary()
+
+        self.building_ids = array('i')
+        self.gameloops = array('i')
+        self.build_offsets = array('q', [0])
+        self.game_offsets = array('q', [0])
+
+        self.race_ids = array('b')
+        self.player_ids = array('i')
+        self.map_ids = array('i')
+        self.game_lengths = array('i')
+        self.max_collection_rates = array('i')
+        self.wins = array('b')
+
+    def __len__(self):
+        return len(self.build_offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f'Build index out of range: {index}')
+        return BuildView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield BuildView(self, index)
+
+    @property
+    def game_count(self):
+        return len(self.game_offsets) - 1
+
+    @property
+    def nbytes(self):
+        """
+        Size of the corpus arrays in bytes, not including vocabularies
+        """
+        return sum(
+            column.itemsize * len(column)
+            for column in (
+                self.building_ids,
+                self.gameloops,
+                self.build_offsets,
+                self.game_offsets,
+                self.race_ids,
+                self.player_ids,
+                self.map_ids,
+                self.game_lengths,
+                self.max_collection_rates,
+                self.wins,
+            )
+        )
+
+    @classmethod
+    def from_games(cls, games, vocabulary=None):
+        """
+        Creates a corpus from games of ParsedBuilds, or of dicts
+        in the format of ParsedBuild.to_json like PARSED_BUILDS
+        """
+        corpus = cls(vocabulary)
+        for game in games:
+            corpus.append_game(game)
+        logger.info(f'Created corpus of {len(corpus)} builds from {corpus.game_count} games')
+        return corpus
+
+    def append_game(self, game):
+        """
+        Adds the builds of a game to the corpus. Builds are only
+        added as part of a game, so every build belongs to one
+        """
+        for build in game:
+            self._append_build(build)
+        self.game_offsets.append(len(self))
+
+    def _append_build(self, build):
+        if isinstance(build, dict):
+            build = ParsedBuild(**build)
+
+        for building, gameloop in build.build:
+            self.building_ids.append(self.vocabulary.intern(building))
+            self.gameloops.append(gameloop)
+        self.build_offsets.append(len(self.building_ids))
+
+        self.race_ids.append(self.races.intern(build.race))
+        self.player_ids.append(self.players.intern(build.player))
+        self.map_ids.append(self.maps.intern(build.game_map))
+        self.game_lengths.append(build.game_length)
+        self.max_collection_rates.append(build.max_collection_rate)
+        self.wins.append(build.win)
+
+    def build_bounds(self, index):
+        return self.build_offsets[index], self.build_offsets[index + 1]
+
+    def game(self, index):
+        return [
+            BuildView(self, build_index)
+            for build_index in range(self.game_offsets[index], self.game_offsets[index + 1])
+        ]
+
+    def games(self):
+        for index in range(self.game_count):
+            yield self.game(index)
+
+    def to_games(self):
+        """
+        Lazily converts each game back into a list of ParsedBuilds
+        """
+        for game in self.games():
+            yield [build.to_parsed_build() for build in game]
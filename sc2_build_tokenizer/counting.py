@@ -0,0 +1,278 @@
+import json
+import logging
+from itertools import repeat
+from operator import itemgetter
+from collections import defaultdict
+
+from sc2_build_tokenizer.pool import map_ordered, optional_numpy, chunk
+from sc2_build_tokenizer.model import Vocabulary
+from sc2_build_tokenizer.metrics import METRICS
+from sc2_build_tokenizer.dataclasses import TokenDistributions
+from sc2_build_tokenizer.tokenize import (
+    generate_build_tokens,
+    generate_token_distributions,
+)
+
+logger = logging.getLogger(__name__)
+
+# tokens are packed into int64 keys, with 0 reserved to separate builds
+SEPARATOR = 0
+MAX_KEY = 2 ** 63 - 1
+
+SHARD_VERSION = 1
+
+
+def _game_matchups(games):
+    """
+    Yields the player race, opponent race and build of each player
+    """
+    for game in games:
+        races = []
+        for build in game:
+            races.append(build.race)
+
+        for build in game:
+            player_race = build.race
+            opp_race = races[0] if races[1] == player_race else races[1]
+            yield player_race, opp_race, build.build
+
+
+def _count_ngrams(building_ids, base, size):
+    """
+    Counts every n-gram of a size in an array of building ids offset by 1,
+    skipping n-grams that cross a separator between builds
+    """
+    import numpy as np
+
+    if len(building_ids) < size:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    windows = np.lib.stride_tricks.sliding_window_view(building_ids, size)
+
+    separators = np.concatenate(([0], np.cumsum(building_ids == SEPARATOR)))
+    windows = windows[separators[size:] - separators[:-size] == 0]
+
+    keys = np.zeros(len(windows), dtype=np.int64)
+    for column in range(size):
+        keys = keys * base + windows[:, column]
+
+    return np.unique(keys, return_counts=True)
+
+
+def _decode_ngrams(keys, base, size, names=None):
+    """
+    Decodes n-gram keys into tokens of building ids, or of the names the
+    ids index if names is an object array, decoding every key at once
+    """
+    import numpy as np
+
+    powers = base ** np.arange(size - 1, -1, -1, dtype=np.int64)
+    building_ids = (keys[:, None] // powers) % base - 1
+    if names is not None:
+        building_ids = names[building_ids]
+    # zipping the columns builds each token tuple directly, without a list per row
+    return zip(*building_ids.T.tolist())
+
+
+def _count_matchup_tokens(np, matchup_builds, max_token_size, vocabulary):
+    """
+    Counts the tokens of each matchup's builds with numpy arrays
+    """
+    encode_ids = vocabulary is not None
+    if not encode_ids:
+        vocabulary = Vocabulary()
+
+    build_tokens = defaultdict(dict)
+    counted = 0
+    for (player_race, opp_race), builds in matchup_builds.items():
+        logger.info(f'Counting tokens for {player_race} / {opp_race}')
+
+        # builds are flattened into one list of names with None between
+        # builds, then every name is mapped to its id offset by 1 at once
+        buildings = []
+        for build in builds:
+            buildings.extend(map(itemgetter(0), build))
+            buildings.append(None)
+
+        for building in dict.fromkeys(buildings):
+            if building is not None:
+                vocabulary.intern(building)
+        offset_ids = {building: building_id + 1 for building, building_id in vocabulary.ids.items()}
+        offset_ids[None] = SEPARATOR
+        building_ids = np.fromiter(map(offset_ids.__getitem__, buildings), dtype=np.int64, count=len(buildings))
+
+        base = len(vocabulary) + 1
+        if base ** max_token_size > MAX_KEY:
+            raise ValueError(f'Tokens of {max_token_size} buildings from {base - 1} building types are too large to count')
+
+        # building names are looked up for every token at once by indexing
+        names = None if encode_ids else np.array(vocabulary.names, dtype=object)
+
+        token_counts = {}
+        for size in range(1, max_token_size + 1):
+            keys, counts = _count_ngrams(building_ids, base, size)
+            counts = counts.tolist()
+            token_counts.update(zip(_decode_ngrams(keys, base, size, names), counts))
+            counted += sum(counts)
+
+        build_tokens[player_race][opp_race] = token_counts
+
+    if METRICS.enabled:
+        METRICS.increment('tokens_counted', counted)
+
+    return build_tokens
+
+
+def count_build_tokens(games, max_token_size=8, vocabulary=None):
+    """
+    Counts the tokens of every build in a corpus of games, grouped by
+    player race and opponent race. Counts are the same as calling
+    generate_build_tokens for each build.
+
+    Builds are encoded as arrays of building ids and the n-grams of each
+    size are counted at once by packing them into integer keys. If numpy
+    isn't installed, tokens are counted one build at a time instead.
+
+    If a vocabulary is supplied, tokens are counted as building ids
+    """
+    logger.info('Counting tokens for corpus of builds')
+
+    matchup_builds = defaultdict(list)
+    for player_race, opp_race, build in _game_matchups(games):
+        matchup_builds[(player_race, opp_race)].append(build)
+
+    np = optional_numpy()
+
+    with METRICS.stage('count_build_tokens'):
+        if np is None:
+            logger.info('numpy is not installed, counting tokens for each build')
+
+            # generate_build_tokens records the tokens it counts itself
+            build_tokens = defaultdict(dict)
+            for (player_race, opp_race), builds in matchup_builds.items():
+                token_counts = defaultdict(int)
+                for build in builds:
+                    token_counts = generate_build_tokens(build, token_counts, vocabulary, max_token_size)
+                build_tokens[player_race][opp_race] = dict(token_counts)
+        else:
+            build_tokens = _count_matchup_tokens(np, matchup_builds, max_token_size, vocabulary)
+
+    logger.info('Completed counting tokens for corpus of builds')
+
+    return dict(build_tokens)
+
+
+class TokenCounts:
+    """
+    Token counts partitioned by matchup. Counts from different shards of
+    a corpus can be merged in any order, and saved to disk so they can
+    be counted in separate processes or on separate machines
+    """
+
+    def __init__(self, counts=None):
+        # {(player_race, opp_race): {token: count}}
+        self.counts = counts if counts is not None else {}
+
+    def __eq__(self, other):
+        return isinstance(other, TokenCounts) and self.counts == other.counts
+
+    @classmethod
+    def from_games(cls, games, max_token_size=8):
+        build_tokens = count_build_tokens(games, max_token_size)
+        return cls({
+            (player_race, opp_race): token_counts
+            for player_race, other_races in build_tokens.items()
+            for opp_race, token_counts in other_races.items()
+        })
+
+    def update(self, other):
+        """
+        Adds the counts from another shard to this one
+        """
+        for matchup, token_counts in other.counts.items():
+            matchup_counts = self.counts.setdefault(matchup, {})
+            for token, count in token_counts.items():
+                matchup_counts[token] = matchup_counts.get(token, 0) + count
+        return self
+
+    def merge(self, other):
+        """
+        Returns a new shard with the counts of both shards
+        """
+        return TokenCounts().update(self).update(other)
+
+    def to_distributions(self):
+        """
+        Generates token distributions nested by player race
+        and opponent race, like the default distributions
+        """
+        distributions = TokenDistributions({}, {})
+        for (player_race, opp_race), token_counts in self.counts.items():
+            matchup_distributions = generate_token_distributions(token_counts)
+            distributions.probability.setdefault(player_race, {})[opp_race] = matchup_distributions.probability
+            distributions.information.setdefault(player_race, {})[opp_race] = matchup_distributions.information
+        return distributions
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as shard:
+            json.dump({
+                'version': SHARD_VERSION,
+                'matchups': [
+                    {
+                        'player_race': player_race,
+                        'opp_race': opp_race,
+                        'tokens': [[list(token), count] for token, count in token_counts.items()],
+                    }
+                    for (player_race, opp_race), token_counts in self.counts.items()
+                ],
+            }, shard)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as shard:
+            data = json.load(shard)
+
+        if data['version'] != SHARD_VERSION:
+            raise ValueError(f'Unsupported token count shard version {data["version"]}: {path}')
+
+        return cls({
+            (matchup['player_race'], matchup['opp_race']): {
+                tuple(token): count for token, count in matchup['tokens']
+            }
+            for matchup in data['matchups']
+        })
+
+
+def merge_token_counts(shards):
+    """
+    Merges token count shards, or paths to saved shards, into one shard
+    """
+    merged = TokenCounts()
+    for shard in shards:
+        if not isinstance(shard, TokenCounts):
+            shard = TokenCounts.load(shard)
+        merged.update(shard)
+    return merged
+
+
+def train_token_distributions(games, *, workers=None, shard_size=1000, max_token_size=8):
+    """
+    Counts tokens for shards of shard_size games, in a pool of processes
+    if workers is set, then merges the shards and generates distributions
+    for each matchup. Games can be any iterable, such as iter_builds
+    """
+    logger.info('Training token distributions')
+
+    if workers:
+        logger.info(f'Counting token shards with {workers} workers')
+
+    counts = merge_token_counts(map_ordered(
+        TokenCounts.from_games,
+        chunk(games, shard_size),
+        repeat(max_token_size),
+        workers=workers,
+    ))
+
+    logger.info('Generating token distributions from merged counts')
+
+    return counts.to_distributions()
@@ -1,4 +1,13 @@
-from sc2_build_tokenizer.data.parsed_builds import PARSED_BUILDS
-from sc2_build_tokenizer.data.tokenized_builds import TOKENIZED_BUILDS
-from sc2_build_tokenizer.data.token_information import TOKEN_INFORMATION
-from sc2_build_tokenizer.data.token_probability import TOKEN_PROBABILITY
+from sc2_build_tokenizer.lazy import lazy_attributes
+
+# datasets are large literals, so they're only imported when first accessed
+DATASETS = {
+    'PARSED_BUILDS': f'{__name__}.parsed_builds',
+    'TOKENIZED_BUILDS': f'{__name__}.tokenized_builds',
+    'TOKEN_INFORMATION': f'{__name__}.token_information',
+    'TOKEN_PROBABILITY': f'{__name__}.token_probability',
+}
+
+__getattr__, __dir__ = lazy_attributes(globals(), DATASETS)
+
+__all__ = list(DATASETS)
@@ -0,0 +1,135 @@
+import math
+import logging
+
+from sc2_build_tokenizer.dataclasses import TokenDistributions
+from sc2_build_tokenizer.tokenize import (
+    generate_build_tokens,
+    MIN_NGRAM_SAMPLES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalDistributions:
+    """
+    Token distributions for one matchup which can be updated as builds are
+    added or removed, without regenerating them from every token count.
+
+    Only the n-gram tokens whose outcome totals changed are recalculated,
+    including tokens crossing the minimum number of samples in either
+    direction. Unigrams are recalculated whenever a build changes, since
+    they all depend on the total number of buildings. The distributions
+    are the same as generate_token_distributions would generate from
+    the current counts.
+    """
+
+    def __init__(self, token_counts=None, max_token_size=8):
+        self.max_token_size = max_token_size
+        self.unigrams = {}
+        self.ngram_tokens = {}
+        self._distributions = TokenDistributions({}, {})
+
+        # the unigrams and the outcomes of each ngram currently in the distributions
+        self._recorded_unigrams = []
+        self._recorded_outcomes = {}
+        self._changed_unigrams = False
+        self._changed_ngrams = set()
+
+        if token_counts:
+            self._update_counts(token_counts, 1)
+
+    @property
+    def distributions(self):
+        self.update()
+        return self._distributions
+
+    def add_build(self, build):
+        logger.debug('Adding build to distributions')
+        self._update_counts(self._build_tokens(build), 1)
+
+    def remove_build(self, build):
+        logger.debug('Removing build from distributions')
+        build_tokens = self._build_tokens(build)
+
+        # check every token first so a build that was
+        # never added doesn't leave counts half removed
+        for token, count in build_tokens.items():
+            if self._token_count(token) < count:
+                raise ValueError(f'Cannot remove build, token {token} was not counted')
+
+        self._update_counts(build_tokens, -1)
+
+    def update(self):
+        """
+        Recalculates the distributions of changed tokens
+        """
+        if self._changed_unigrams:
+            logger.info('Recalculating unigram distributions')
+            self._update_unigrams()
+            self._changed_unigrams = False
+
+        if self._changed_ngrams:
+            logger.info(f'Recalculating distributions for {len(self._changed_ngrams)} ngram tokens')
+            for ngram in self._changed_ngrams:
+                self._update_ngram(ngram)
+            self._changed_ngrams.clear()
+
+    def _build_tokens(self, build):
+        return generate_build_tokens(build, max_token_size=self.max_token_size)
+
+    def _token_count(self, token):
+        if len(token) == 1:
+            return self.unigrams.get(token, 0)
+        return self.ngram_tokens.get(token[:-1], {}).get(token[-1], 0)
+
+    def _update_counts(self, build_tokens, sign):
+        for token, count in build_tokens.items():
+            if len(token) == 1:
+                counts = self.unigrams
+                outcome = token
+                self._changed_unigrams = True
+            else:
+                counts = self.ngram_tokens.setdefault(token[:-1], {})
+                outcome = token[-1]
+                self._changed_ngrams.add(token[:-1])
+
+            counts[outcome] = counts.get(outcome, 0) + sign * count
+            if not counts[outcome]:
+                del counts[outcome]
+
+    def _update_unigrams(self):
+        probability = self._distributions.probability
+        information = self._distributions.information
+
+        for token in self._recorded_unigrams:
+            del probability[token]
+            del information[token]
+
+        total = sum(self.unigrams.values())
+        for token, count in self.unigrams.items():
+            probability[token] = count / total
+            information[token] = -math.log2(count / total)
+        self._recorded_unigrams = list(self.unigrams)
+
+    def _update_ngram(self, ngram):
+        probability = self._distributions.probability
+        information = self._distributions.information
+
+        for predicted in self._recorded_outcomes.pop(ngram, ()):
+            del probability[(*ngram, predicted)]
+            del information[(*ngram, predicted)]
+
+        outcomes = self.ngram_tokens.get(ngram)
+        if not outcomes:
+            self.ngram_tokens.pop(ngram, None)
+            return
+
+        total = sum(outcomes.values())
+        if total < MIN_NGRAM_SAMPLES:
+            logger.debug(f'Insufficient occurences of token {ngram}: {total}')
+            return
+
+        for predicted, count in outcomes.items():
+            probability[(*ngram, predicted)] = count / total
+            information[(*ngram, predicted)] = -math.log2(count / total)
+        self._recorded_outcomes[ngram] = list(outcomes)
@@ -0,0 +1,21 @@
+import importlib
+
+
+def lazy_attributes(module_globals, attributes):
+    """
+    Returns module __getattr__ and __dir__ functions which import each
+    attribute from its module, given by attributes, when it's first
+    accessed. Imported attributes are cached in the module's globals
+    """
+    def __getattr__(name):
+        if name not in attributes:
+            raise AttributeError(f'module {module_globals["__name__"]!r} has no attribute {name!r}')
+
+        value = getattr(importlib.import_module(attributes[name]), name)
+        module_globals[name] = value
+        return value
+
+    def __dir__():
+        return sorted({*module_globals, *attributes})
+
+    return __getattr__, __dir__
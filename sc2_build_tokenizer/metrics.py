@@ -0,0 +1,81 @@
+import time
+import threading
+from contextlib import nullcontext
+from collections import defaultdict
+
+# returned by Metrics.stage while metrics are disabled,
+# so timing a stage doesn't create anything
+DISABLED_STAGE = nullcontext()
+
+
+class Metrics:
+    """
+    Counters and per-stage timings for the hot paths of the tokenizer.
+
+    Recording is disabled by default. Hot loops count locally and check
+    enabled once before recording, so disabled metrics cost an attribute
+    lookup per call rather than any work per iteration
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+            self.calls.clear()
+
+    def increment(self, name, count=1):
+        with self._lock:
+            self.counters[name] += count
+
+    def stage(self, name):
+        """
+        Times a block of code, recording the total time and number of calls
+        """
+        if not self.enabled:
+            return DISABLED_STAGE
+        return _Stage(self, name)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'stages': {
+                    name: {
+                        'calls': self.calls[name],
+                        'seconds': seconds,
+                    }
+                    for name, seconds in self.timings.items()
+                },
+            }
+
+
+class _Stage:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        with self.metrics._lock:
+            self.metrics.timings[self.name] += elapsed
+            self.metrics.calls[self.name] += 1
+
+
+METRICS = Metrics()
@@ -0,0 +1,379 @@
+import sys
+import math
+import mmap
+import struct
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+
+from sc2_build_tokenizer.dataclasses import TokenDistributions
+
+logger = logging.getLogger(__name__)
+
+ROOT_NODE = 0
+MISSING_NODE = -1
+UNKNOWN_BUILDING = -1
+
+# binary model files are laid out as:
+#   header: magic, version, byte order, vocabulary, matchup index
+#   matchups: probability (f64), information (f64), building (i32) and
+#   child_start (i32) arrays for each matchup, aligned to 8 bytes
+MODEL_MAGIC = b'SC2TOKM\x00'
+MODEL_VERSION = 1
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+
+class Vocabulary:
+    """
+    Interns building names as small integer ids
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def intern(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def encode(self, buildings):
+        """
+        Maps building names to ids without adding new names.
+        Unknown buildings are encoded as UNKNOWN_BUILDING
+        """
+        return [self.ids.get(building, UNKNOWN_BUILDING) for building in buildings]
+
+    def decode(self, building_ids):
+        return tuple(self.names[building_id] for building_id in building_ids)
+
+
+class TokenTrie:
+    """
+    Prefix trie of token probabilities and information for one matchup.
+
+    Nodes are numbered in breadth first order and stored in flat arrays.
+    The children of a node are the contiguous nodes from child_start[node]
+    to child_start[node + 1], sorted by building id so a child can be
+    found with a binary search. Nodes without a recorded token have NaN
+    probability and information.
+    """
+
+    def __init__(self, building, child_start, probability, information):
+        self.building = building
+        self.child_start = child_start
+        self.probability = probability
+        self.information = information
+
+    def __len__(self):
+        return len(self.building)
+
+    def __contains__(self, token_ids):
+        node = self.find(token_ids)
+        return node != MISSING_NODE and not math.isnan(self.probability[node])
+
+    @classmethod
+    def from_distributions(cls, token_probability, token_information, vocabulary):
+        """
+        Compiles flat token distributions for a single matchup. Tokens can
+        contain building names, which are interned in the vocabulary,
+        or building ids from the same vocabulary
+        """
+        logger.info('Compiling token trie from token distributions')
+
+        # build a nested trie first, then flatten it breadth first
+        root = {}
+        for token, probability in token_probability.items():
+            node = root
+            for building in token:
+                building_id = (
+                    building
+                    if isinstance(building, int)
+                    else vocabulary.intern(building)
+                )
+                node = node.setdefault(building_id, {})
+            node[None] = (probability, token_information[token])
+
+        building = array('i', [UNKNOWN_BUILDING])
+        child_start = array('i')
+        probability = array('d', [math.nan])
+        information = array('d', [math.nan])
+
+        queue = [root]
+        for node in queue:
+            child_start.append(len(building))
+            for building_id in sorted(key for key in node if key is not None):
+                child = node[building_id]
+                child_probability, child_information = child.get(None, (math.nan, math.nan))
+
+                building.append(building_id)
+                probability.append(child_probability)
+                information.append(child_information)
+                queue.append(child)
+        child_start.append(len(building))
+
+        logger.info(f'Compiled token trie with {len(building)} nodes')
+
+        return cls(building, child_start, probability, information)
+
+    def child(self, node, building_id):
+        start = self.child_start[node]
+        end = self.child_start[node + 1]
+        index = bisect_left(self.building, building_id, start, end)
+        if index < end and self.building[index] == building_id:
+            return index
+        return MISSING_NODE
+
+    def find(self, token_ids):
+        node = ROOT_NODE
+        for building_id in token_ids:
+            node = self.child(node, building_id)
+            if node == MISSING_NODE:
+                break
+        return node
+
+
+class TokenModel:
+    """
+    Compiled token distributions for one or more matchups,
+    sharing a single building vocabulary
+    """
+
+    def __init__(self, vocabulary=None, matchups=None, path=None):
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self.matchups = matchups if matchups is not None else {}
+        self.path = path
+
+    def __reduce__(self):
+        # memory-mapped models are loaded from their file again when unpickled,
+        # so processes share its pages rather than receiving a copy
+        if self.path is not None:
+            return (TokenModel.load, (self.path,))
+        return (TokenModel, (self.vocabulary, self.matchups))
+
+    @classmethod
+    def from_distributions(cls, distributions, vocabulary=None):
+        """
+        Compiles a TokenDistributions object. Distributions can either be for a
+        single matchup, or nested by player race and opponent race like
+        the default distributions
+        """
+        model = cls(vocabulary)
+
+        if _is_flat_distribution(distributions.probability):
+            model.matchups[(None, None)] = TokenTrie.from_distributions(
+                distributions.probability,
+                distributions.information,
+                model.vocabulary,
+            )
+            return model
+
+        for player_race, other_races in distributions.probability.items():
+            for opp_race, token_probability in other_races.items():
+                logger.info(f'Compiling distributions for {player_race} / {opp_race}')
+                model.matchups[(player_race, opp_race)] = TokenTrie.from_distributions(
+                    token_probability,
+                    distributions.information[player_race][opp_race],
+                    model.vocabulary,
+                )
+
+        return model
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a binary model file. Matchups are only read from the
+        file when they are first used, and the arrays of each matchup are
+        views of the mapped file, so processes loading the same model
+        share its pages rather than holding their own copy
+        """
+        logger.info(f'Loading token model: {path}')
+
+        with open(path, 'rb') as model_file:
+            buffer = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byte_order = struct.unpack_from('<8sIB', buffer, 0)
+        if magic != MODEL_MAGIC:
+            raise ValueError(f'Not a token model file: {path}')
+        if version != MODEL_VERSION:
+            raise ValueError(f'Unsupported token model version {version}: {path}')
+
+        offset = struct.calcsize('<8sIB')
+        vocabulary = Vocabulary()
+        vocabulary_size, = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        for _ in range(vocabulary_size):
+            name, offset = _unpack_string(buffer, offset)
+            vocabulary.intern(name)
+
+        index = {}
+        matchup_count, = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+        for _ in range(matchup_count):
+            player_race, offset = _unpack_string(buffer, offset)
+            opp_race, offset = _unpack_string(buffer, offset)
+            index[(player_race or None, opp_race or None)] = struct.unpack_from('<QI', buffer, offset)
+            offset += struct.calcsize('<QI')
+
+        swap = byte_order != BYTE_ORDERS[sys.byteorder]
+        return cls(vocabulary, _MappedMatchups(buffer, index, swap), path)
+
+    def save(self, path):
+        """
+        Writes the model to a binary file which can be memory-mapped by load
+        """
+        logger.info(f'Saving token model: {path}')
+
+        header = bytearray(struct.pack('<8sIB', MODEL_MAGIC, MODEL_VERSION, BYTE_ORDERS[sys.byteorder]))
+        header += struct.pack('<I', len(self.vocabulary))
+        for name in self.vocabulary.names:
+            header += _pack_string(name)
+
+        matchups = list(self.matchups.items())
+        header += struct.pack('<I', len(matchups))
+        index_offsets = []
+        for (player_race, opp_race), trie in matchups:
+            header += _pack_string(player_race or '')
+            header += _pack_string(opp_race or '')
+            index_offsets.append(len(header))
+            header += struct.pack('<QI', 0, 0)
+
+        sections = []
+        offset = _align(len(header))
+        for index_offset, (_, trie) in zip(index_offsets, matchups):
+            struct.pack_into('<QI', header, index_offset, offset, len(trie))
+            section = b''.join([
+                _to_array('d', trie.probability).tobytes(),
+                _to_array('d', trie.information).tobytes(),
+                _to_array('i', trie.building).tobytes(),
+                _to_array('i', trie.child_start).tobytes(),
+            ])
+            sections.append(section)
+            offset = _align(offset + len(section))
+
+        with open(path, 'wb') as model_file:
+            model_file.write(header)
+            for section in sections:
+                model_file.write(bytes(_align(model_file.tell()) - model_file.tell()))
+                model_file.write(section)
+
+    def trie(self, player_race, opp_race):
+        """
+        Returns the trie for a matchup, falling back to the distributions
+        compiled without a matchup, or None if the model has neither
+        """
+        if (player_race, opp_race) in self.matchups:
+            return self.matchups[(player_race, opp_race)]
+        return self.matchups.get((None, None))
+
+    def to_distributions(self):
+        distributions = TokenDistributions({}, {})
+        for (player_race, opp_race), trie in self.matchups.items():
+            token_probability = {}
+            token_information = {}
+
+            tokens = [()]
+            for node in range(1, len(trie)):
+                parent = tokens[_parent_node(trie, node)]
+                tokens.append((*parent, self.vocabulary.names[trie.building[node]]))
+                if not math.isnan(trie.probability[node]):
+                    token_probability[tokens[node]] = trie.probability[node]
+                    token_information[tokens[node]] = trie.information[node]
+
+            if (player_race, opp_race) == (None, None):
+                distributions.probability.update(token_probability)
+                distributions.information.update(token_information)
+                continue
+
+            distributions.probability.setdefault(player_race, {})[opp_race] = token_probability
+            distributions.information.setdefault(player_race, {})[opp_race] = token_information
+
+        return distributions
+
+
+def _is_flat_distribution(distribution):
+    return all(isinstance(token, tuple) for token in distribution)
+
+
+def _parent_node(trie, node):
+    # child_start is sorted, so the parent is the last
+    # node whose children start at or before this node
+    return bisect_right(trie.child_start, node) - 1
+
+
+class _MappedMatchups(Mapping):
+    """
+    Matchup tries of a memory-mapped model file, created on first access
+    """
+
+    def __init__(self, buffer, index, swap=False):
+        self._buffer = memoryview(buffer)
+        self._index = index
+        self._swap = swap
+        self._tries = {}
+
+    def __getitem__(self, matchup):
+        if matchup not in self._tries:
+            offset, node_count = self._index[matchup]
+            logger.debug(f'Mapping {node_count} nodes for {matchup[0]} / {matchup[1]}')
+
+            arrays = []
+            for typecode, length in [
+                ('d', node_count),
+                ('d', node_count),
+                ('i', node_count),
+                ('i', node_count + 1),
+            ]:
+                size = length * array(typecode).itemsize
+                values = self._buffer[offset:offset + size].cast(typecode)
+
+                # files written on a machine with a different byte order
+                # have to be copied so they can be swapped
+                if self._swap:
+                    values = array(typecode, values.tobytes())
+                    values.byteswap()
+
+                arrays.append(values)
+                offset += size
+
+            probability, information, building, child_start = arrays
+            self._tries[matchup] = TokenTrie(building, child_start, probability, information)
+
+        return self._tries[matchup]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def _align(offset, alignment=8):
+    return offset + (-offset % alignment)
+
+
+def _to_array(typecode, values):
+    if isinstance(values, array):
+        return values
+    return array(typecode, values)
+
+
+def _pack_string(value):
+    encoded = value.encode('utf-8')
+    return struct.pack('<H', len(encoded)) + encoded
+
+
+def _unpack_string(buffer, offset):
+    length, = struct.unpack_from('<H', buffer, offset)
+    offset += 2
+    return bytes(buffer[offset:offset + length]).decode('utf-8'), offset + length
@@ -0,0 +1,201 @@
+import heapq
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class OpenerNode:
+    """
+    Node of an opener trie, for the builds that start with the tokens on
+    the path to the node. ends counts the builds with no more tokens
+    """
+    __slots__ = ('children', 'count', 'wins', 'ends', 'players', 'maps', 'builds')
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0
+        self.wins = 0
+        self.ends = 0
+        self.players = defaultdict(int)
+        self.maps = defaultdict(int)
+        self.builds = []
+
+
+class OpenerIndex:
+    """
+    Counting prefix tries of the token sequences of tokenized builds, with
+    a trie for each matchup. Every node records how many builds share its
+    prefix, how many of them won, the players and maps they were played by
+    and on, and the keys of the builds.
+
+    Queries about a prefix only visit the nodes on the path to the prefix,
+    so they take time proportional to the prefix rather than the corpus.
+    Builds can be added at any time
+    """
+
+    def __init__(self):
+        self.roots = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, tokenized_build, opp_race, *, win=False, game_map=None, key=None):
+        """
+        Adds a tokenized build, returning its key. The key
+        defaults to the number of builds added before it
+        """
+        if key is None:
+            key = self.size
+        self.size += 1
+
+        matchup = (tokenized_build.race, opp_race)
+        if matchup not in self.roots:
+            self.roots[matchup] = OpenerNode()
+
+        node = self.roots[matchup]
+        self._record(node, tokenized_build, win, game_map, key)
+        for token in tokenized_build.tokens:
+            token = tuple(token)
+            if token not in node.children:
+                node.children[token] = OpenerNode()
+            node = node.children[token]
+            self._record(node, tokenized_build, win, game_map, key)
+        node.ends += 1
+
+        return key
+
+    @staticmethod
+    def _record(node, tokenized_build, win, game_map, key):
+        node.count += 1
+        node.wins += bool(win)
+        node.players[tokenized_build.player] += 1
+        if game_map is not None:
+            node.maps[game_map] += 1
+        node.builds.append(key)
+
+    def add_game(self, tokenized_game, parsed_game=None, key=None):
+        """
+        Adds the tokenized builds of a game, such as a game from
+        tokenize_games. If the parsed builds of the game are supplied,
+        wins and maps are recorded from them. Builds are keyed by
+        (key, index in game) if a key is supplied.
+
+        A build's opponent is the other build of the game. With parsed
+        builds, it's the other build of the parsed game, which doesn't
+        need to line up with the tokenized game. Otherwise builds whose
+        opponent couldn't be tokenized are skipped
+        """
+        # races keep the position of builds that couldn't be tokenized
+        races = [
+            tokenized_build.race if tokenized_build is not None else None
+            for tokenized_build in tokenized_game
+        ]
+        parsed_builds = {}
+        if parsed_game is not None:
+            parsed_builds = {(build.race, build.player): build for build in parsed_game}
+
+        keys = []
+        for index, tokenized_build in enumerate(tokenized_game):
+            if tokenized_build is None:
+                continue
+
+            parsed_build = parsed_builds.get((tokenized_build.race, tokenized_build.player))
+            if parsed_game is not None:
+                opp_races = [build.race for build in parsed_game if build is not parsed_build]
+            else:
+                opp_races = [race for opp_index, race in enumerate(races) if opp_index != index]
+
+            if len(opp_races) != 1 or opp_races[0] is None:
+                logger.debug(f'Skipping build of {tokenized_build.player}, opponent race is unknown')
+                continue
+
+            keys.append(self.add(
+                tokenized_build,
+                opp_races[0],
+                win=parsed_build.win if parsed_build is not None else False,
+                game_map=parsed_build.game_map if parsed_build is not None else None,
+                key=(key, index) if key is not None else None,
+            ))
+
+        return keys
+
+    def node(self, race, opp_race, prefix=()):
+        """
+        Returns the node of a prefix of tokens, or None if no builds start with it
+        """
+        node = self.roots.get((race, opp_race))
+        for token in prefix:
+            if node is None:
+                return None
+            node = node.children.get(tuple(token))
+        return node
+
+    def count(self, race, opp_race, prefix=()):
+        node = self.node(race, opp_race, prefix)
+        return node.count if node is not None else 0
+
+    def builds(self, race, opp_race, prefix=()):
+        """
+        Returns the keys of the builds that start with a prefix of tokens
+        """
+        node = self.node(race, opp_race, prefix)
+        return list(node.builds) if node is not None else []
+
+    def continuations(self, race, opp_race, prefix=(), n=10, player=None):
+        """
+        Returns up to n (token, count, wins) tuples of the most common
+        tokens after a prefix, optionally only counting one player's builds.
+        Wins are for every player
+        """
+        node = self.node(race, opp_race, prefix)
+        if node is None:
+            return []
+
+        continuations = (
+            (token, child.count if player is None else child.players.get(player, 0), child.wins)
+            for token, child in node.children.items()
+        )
+        return heapq.nlargest(
+            n,
+            (continuation for continuation in continuations if continuation[1]),
+            key=lambda continuation: continuation[1],
+        )
+
+    def openers(self, race, opp_race, min_buildings=4, n=None, player=None):
+        """
+        Returns (opener, count) tuples of the most common openers in order of
+        decreasing count, optionally only counting one player's builds. An
+        opener is the shortest sequence of tokens with at least min_buildings
+        buildings, or the whole build if it has fewer buildings
+        """
+        root = self.roots.get((race, opp_race))
+        if root is None:
+            return []
+
+        def build_count(node):
+            return node.count if player is None else node.players.get(player, 0)
+
+        openers = []
+        stack = [(root, (), 0)]
+        while stack:
+            node, prefix, buildings = stack.pop()
+            if not build_count(node):
+                continue
+
+            if buildings >= min_buildings:
+                openers.append((prefix, build_count(node)))
+                continue
+
+            # only builds that end here have this prefix as their opener
+            if node.ends and prefix:
+                ends = build_count(node) - sum(build_count(child) for child in node.children.values())
+                if ends:
+                    openers.append((prefix, ends))
+
+            for token, child in node.children.items():
+                stack.append((child, (*prefix, token), buildings + len(token)))
+
+        openers.sort(key=lambda opener: opener[1], reverse=True)
+        return openers[:n] if n is not None else openers
@@ -1,10 +1,13 @@
 import traceback
 import logging
 from pathlib import PurePath
+from dataclasses import replace
+from itertools import repeat
 from collections import defaultdict
-from zephyrus_sc2_parser import parse_replay
 
+from sc2_build_tokenizer.pool import map_ordered
 from sc2_build_tokenizer.dataclasses import ParsedBuild
+from sc2_build_tokenizer.replay_cache import ReplayCache
 from sc2_build_tokenizer.constants import IGNORE_OBJECTS
 
 logger = logging.getLogger(__name__)
@@ -13,92 +16,194 @@ logger = logging.getLogger(__name__)
 SEVEN_MINUTES = 9408
 ERRORS = defaultdict(int)
 
+# replay caches opened by worker processes, by path
+WORKER_CACHES = {}
 
-def _recurse(dir_path, fn=None):
+
+def _parse_replay(replay_path):
+    # the parser is slow to import, so wait until there's a replay to parse
+    from zephyrus_sc2_parser import parse_replay
+
+    return parse_replay(replay_path, local=True, network=False)
+
+
+def replay_paths(dir_path):
     """
-    Recursively searches directories to parse replay files
+    Yields a replay file, or recursively searches a directory for replay files
     """
     if dir_path.is_file():
-        try:
-            replay = parse_replay(dir_path, local=True, network=False)
-            logger.info(f'Parsed replay: {dir_path.name}')
-            return [fn(replay) if fn else replay]
-        except Exception:
-            ERRORS[traceback.format_exc()] += 1
-            logger.error(f'An error occured during parsing: {traceback.format_exc()}')
-            return []
-
-    results = []
+        yield dir_path
+        return
+
     logger.info(f'In directory: {dir_path.name}')
     for obj_path in dir_path.iterdir():
         if obj_path.is_file():
-            try:
-                replay = parse_replay(obj_path, local=True, network=False)
-                logger.info(f'Parsed replay: {obj_path.name}')
-            except Exception:
-                ERRORS[traceback.format_exc()] += 1
-                logger.error(f'An error occured during parsing: {traceback.format_exc()}')
-                continue
-
-            results.append(fn(replay) if fn else replay)
+            yield obj_path
         elif obj_path.is_dir():
             logger.info(f'Found new directory: {obj_path.name}')
-            results.extend(_recurse(obj_path, fn))
+            yield from replay_paths(obj_path)
 
-    return results
 
+def _extract_replay_buildings(replay):
+    """
+    Extracts every building from a replay, before the end
+    and ignore filters are applied to the builds
+    """
+    replay_builds = []
+    for p_id, player in replay.players.items():
+        logger.debug(f'Recording {player.race} build')
+        player_build = ParsedBuild(
+            player.race,
+            player.name,
+            replay.metadata['map'],
+            replay.metadata['game_length'],
+            min(replay.summary['max_collection_rate'].values()),
+            replay.metadata['winner'] == p_id,
+            [],
+        )
+
+        logger.debug(f'Iterating through player objects')
+        filtered_objects = list(filter(lambda obj: obj.init_time and obj.birth_time, player.objects.values()))
+        sorted_objects = sorted(
+            filtered_objects,
+            key=lambda obj: obj.init_time,
+        )
+        for obj in sorted_objects:
+            if 'BUILDING' in obj.type:
+                player_build.build.append((obj.name_at_gameloop(0), obj.init_time))
+                logger.debug(f'Recording {obj.name_at_gameloop(0)}, @{obj.init_time}')
+
+        replay_builds.append(player_build)
+        logger.debug(f'Finished recording {player.race} build')
+
+    return replay_builds
+
+
+def _filter_builds(replay_builds, end, ignore):
+    return [
+        replace(player_build, build=[
+            (building, init_time)
+            for building, init_time in player_build.build
+            if init_time <= end and building not in ignore
+        ])
+        for player_build in replay_builds
+    ]
+
+
+def _extract_replay_builds(replay, end, ignore):
+    return _filter_builds(_extract_replay_buildings(replay), end, ignore)
+
+
+def _parse_replay_buildings(replay_path, cache=None):
+    """
+    Parses a replay and extracts its buildings, in a worker process if
+    extracting with workers. Only the extracted builds are sent back to
+    the parent process, along with the traceback if the replay couldn't
+    be parsed.
 
-def extract_builds(replays, end=SEVEN_MINUTES, ignore=IGNORE_OBJECTS):
+    If a cache is supplied, cached builds are returned without parsing
+    the replay, along with the hash of the replay and whether it was cached
     """
-    9408 = 7min
+    try:
+        content_hash = None
+        if cache is not None:
+            # workers are sent the cache path since connections can't be pickled
+            if not isinstance(cache, ReplayCache):
+                cache = _open_worker_cache(cache)
+
+            content_hash = ReplayCache.hash_replay(replay_path)
+            cached_builds = cache.get(content_hash)
+            if cached_builds is not None:
+                logger.info(f'Found cached replay: {replay_path.name}')
+                return cached_builds, content_hash, True, None
+
+        replay = _parse_replay(replay_path)
+        logger.info(f'Parsed replay: {replay_path.name}')
+        return _extract_replay_buildings(replay), content_hash, False, None
+    except Exception:
+        return None, None, False, traceback.format_exc()
+
+
+def _open_worker_cache(cache_path):
+    if cache_path not in WORKER_CACHES:
+        WORKER_CACHES[cache_path] = ReplayCache(cache_path)
+    return WORKER_CACHES[cache_path]
+
+
+def _iter_replay_file_buildings(replay_path, workers, cache):
+    if not workers:
+        yield from map(_parse_replay_buildings, replay_paths(replay_path), repeat(cache))
+        return
+
+    logger.info(f'Parsing replay files with {workers} workers')
+    yield from map_ordered(
+        _parse_replay_buildings,
+        replay_paths(replay_path),
+        repeat(cache.path if cache is not None else None),
+        workers=workers,
+    )
+
+
+def iter_builds(
+    replays,
+    end=SEVEN_MINUTES,
+    ignore=IGNORE_OBJECTS,
+    workers=None,
+    cache=None,
+):
     """
-    logger.info('Parsing builds from replays')
-    parsed_replays = replays
-    if isinstance(replays, PurePath):
-        logger.info('Parsing replay files')
-        parsed_replays = _recurse(replays)
-        logger.info('Completed parsing replay files')
-
-    logger.info('Extracting builds from replays')
-
-    builds = []
-    for replay in parsed_replays:
-        replay_builds = []
-        for p_id, player in replay.players.items():
-            logger.debug(f'Recording {player.race} build')
-            player_build = ParsedBuild(
-                player.race,
-                player.name,
-                replay.metadata['map'],
-                replay.metadata['game_length'],
-                min(replay.summary['max_collection_rate'].values()),
-                replay.metadata['winner'] == p_id,
-                [],
-            )
-
-            logger.debug(f'Iterating through player objects')
-            filtered_objects = list(filter(lambda obj: obj.init_time and obj.birth_time, player.objects.values()))
-            sorted_objects = sorted(
-                filtered_objects,
-                key=lambda obj: obj.init_time,
-            )
-            for obj in sorted_objects:
-                if (
-                    obj.init_time > end
-                    or obj.name_at_gameloop(0) in ignore
-                ):
-                    continue
-
-                if 'BUILDING' in obj.type:
-                    player_build.build.append((obj.name_at_gameloop(0), obj.init_time))
-                    logger.debug(f'Recording {obj.name_at_gameloop(0)}, @{obj.init_time}')
-
-            replay_builds.append(player_build)
-            logger.debug(f'Finished recording {player.race} build')
-
-        builds.append(replay_builds)
+    Lazily extracts builds, yielding the builds from each game as soon as
+    its replay is parsed. Replay objects are discarded once their builds
+    are extracted, so memory doesn't grow with the number of replays.
+
+    If workers is set, replay files are parsed and
+    their builds extracted in a pool of processes.
+
+    If cache is set to a ReplayCache or a path, builds extracted from
+    replay files are stored in it and replays that have already been
+    extracted aren't parsed again
+    """
+    if not isinstance(replays, PurePath):
+        logger.info('Extracting builds from replays')
+        for replay in replays:
+            logger.info('Extracted builds from game')
+            yield _extract_replay_builds(replay, end, ignore)
+        return
+
+    if cache is not None and not isinstance(cache, ReplayCache):
+        cache = ReplayCache(cache)
+
+    logger.info('Parsing builds from replay files')
+    for replay_builds, content_hash, cached, error in _iter_replay_file_buildings(replays, workers, cache):
+        if error:
+            ERRORS[error] += 1
+            logger.error(f'An error occured during parsing: {error}')
+            continue
+
+        if cache is not None and not cached:
+            cache.set(content_hash, replay_builds)
+
         logger.info('Extracted builds from game')
+        yield _filter_builds(replay_builds, end, ignore)
+
+
+def extract_builds(
+    replays,
+    end=SEVEN_MINUTES,
+    ignore=IGNORE_OBJECTS,
+    workers=None,
+    cache=None,
+):
+    """
+    9408 = 7min
+
+    If workers is set, replay files are parsed and
+    their builds extracted in a pool of processes.
 
+    If cache is set, builds are stored in and loaded from a ReplayCache
+    """
+    logger.info('Parsing builds from replays')
+    builds = list(iter_builds(replays, end, ignore, workers, cache))
     logger.info('Completed build extraction')
 
     return builds
@@ -0,0 +1,286 @@
+import os
+import json
+import logging
+from pathlib import Path
+from itertools import repeat
+from contextlib import contextmanager
+
+from sc2_build_tokenizer.pool import map_ordered, chunk
+from sc2_build_tokenizer.parse import (
+    ERRORS,
+    SEVEN_MINUTES,
+    iter_builds,
+    replay_paths,
+)
+from sc2_build_tokenizer.batch import tokenize_games
+from sc2_build_tokenizer.model import TokenModel
+from sc2_build_tokenizer.counting import TokenCounts, merge_token_counts
+from sc2_build_tokenizer.tokenize import generate_token_distributions
+from sc2_build_tokenizer.constants import IGNORE_OBJECTS
+from sc2_build_tokenizer.serialize import (
+    read_builds,
+    write_builds,
+    write_tokenized_builds,
+)
+from sc2_build_tokenizer.dataclasses import TokenDistributions
+from sc2_build_tokenizer.replay_cache import EXTRACTION_VERSION
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+STAGES = ['parse', 'count', 'distributions', 'tokenize']
+
+MANIFEST = 'manifest.json'
+REPLAY_CACHE = 'replay_cache.db'
+BUILDS = 'builds.jsonl'
+COUNT_SHARDS = 'count_shards'
+TOKEN_COUNTS = 'token_counts.json'
+TOKEN_MODEL = 'token_model.bin'
+TOKENIZED_BUILDS = 'tokenized_builds.jsonl'
+
+
+class StageInputError(Exception):
+    pass
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Yields a temporary path to write a file to, which replaces
+    the file at path only once it has been completely written
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _fingerprint(*values):
+    import hashlib
+
+    fingerprint = hashlib.sha256()
+    for value in values:
+        fingerprint.update(json.dumps(value, sort_keys=True, default=str).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def _hash_file(path):
+    import hashlib
+
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as artifact:
+        for block in iter(lambda: artifact.read(1 << 20), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def _count_shard(pending_shard, max_token_size):
+    games, shard_path = pending_shard
+    with atomic_path(shard_path) as tmp_path:
+        TokenCounts.from_games(games, max_token_size).save(tmp_path)
+    return shard_path
+
+
+class Pipeline:
+    """
+    Runs the parse, count, distributions and tokenize stages, storing the
+    artifacts of each stage in a directory along with a manifest of the
+    inputs each artifact was generated from.
+
+    Stages whose inputs haven't changed since their artifact was generated
+    are skipped. Artifacts are only replaced once they've been completely
+    written, and parsed replays and token count shards are kept as they're
+    completed, so a stage that stops partway through resumes where it left off
+    """
+
+    def __init__(self, output_dir, *, workers=None, force=False):
+        self.output_dir = Path(output_dir)
+        self.workers = workers
+        self.force = force
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def path(self, artifact):
+        return self.output_dir / artifact
+
+    def _load_manifest(self):
+        manifest_path = self.path(MANIFEST)
+        if manifest_path.exists():
+            with open(manifest_path, encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+
+        return {'version': MANIFEST_VERSION, 'stages': {}}
+
+    def _save_manifest(self):
+        with atomic_path(self.path(MANIFEST)) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+                json.dump(self.manifest, manifest_file, indent=2)
+
+    def is_complete(self, stage, fingerprint):
+        record = self.manifest['stages'].get(stage)
+        return (
+            not self.force
+            and record is not None
+            and record['fingerprint'] == fingerprint
+            and self.path(record['artifact']).exists()
+        )
+
+    def _complete(self, stage, fingerprint, artifact, items):
+        self.manifest['stages'][stage] = {
+            'fingerprint': fingerprint,
+            'artifact': artifact,
+            'items': items,
+        }
+        self._save_manifest()
+        logger.info(f'Completed {stage} stage: {items} items')
+
+    def _require(self, artifact, stage):
+        artifact_path = self.path(artifact)
+        if not artifact_path.exists():
+            raise StageInputError(f'{artifact_path} does not exist, run the {stage} stage first')
+        return artifact_path
+
+    def parse(self, replays, end=SEVEN_MINUTES, ignore=IGNORE_OBJECTS):
+        """
+        Extracts the builds from replay files. Extracted builds are stored in
+        a replay cache as each replay is parsed, so replays that were parsed
+        before the stage stopped aren't parsed again
+        """
+        replays = Path(replays)
+        if not replays.exists():
+            raise StageInputError(f'{replays} does not exist, expected a replay file or directory of replays')
+
+        replay_files = sorted(
+            (str(replay_path), replay_path.stat().st_size, replay_path.stat().st_mtime_ns)
+            for replay_path in replay_paths(replays)
+        )
+        fingerprint = _fingerprint(replay_files, end, list(ignore), EXTRACTION_VERSION)
+        if self.is_complete('parse', fingerprint):
+            logger.info('Replays are unchanged, skipping parse stage')
+            return False
+
+        logger.info(f'Parsing {len(replay_files)} replay files')
+        with atomic_path(self.path(BUILDS)) as tmp_path:
+            games = write_builds(tmp_path, iter_builds(
+                replays,
+                end,
+                ignore,
+                workers=self.workers,
+                cache=self.path(REPLAY_CACHE),
+            ))
+
+        if ERRORS:
+            logger.warning(f'{sum(ERRORS.values())} replays could not be parsed')
+
+        self._complete('parse', fingerprint, BUILDS, games)
+        return True
+
+    def count(self, shard_size=1000, max_token_size=8):
+        """
+        Counts the tokens of the extracted builds in shards of shard_size
+        games, then merges the shards. Each shard is saved when it's counted,
+        so only uncounted shards are counted if the stage is resumed
+        """
+        builds_path = self._require(BUILDS, 'parse')
+        fingerprint = _fingerprint(_hash_file(builds_path), shard_size, max_token_size)
+        if self.is_complete('count', fingerprint):
+            logger.info('Builds are unchanged, skipping count stage')
+            return False
+
+        # shards are stored by fingerprint so stale shards are never reused
+        shard_dir = self.path(COUNT_SHARDS) / fingerprint[:16]
+        shard_dir.mkdir(parents=True, exist_ok=True)
+
+        shard_paths = []
+
+        def pending_shards():
+            for index, shard in enumerate(chunk(read_builds(builds_path), shard_size)):
+                shard_path = shard_dir / f'shard-{index:05}.json'
+                shard_paths.append(shard_path)
+                if shard_path.exists():
+                    logger.info(f'Found counted shard: {shard_path.name}')
+                    continue
+                yield shard, shard_path
+
+        if self.workers:
+            logger.info(f'Counting shards with {self.workers} workers')
+
+        for _ in map_ordered(
+            _count_shard,
+            pending_shards(),
+            repeat(max_token_size),
+            workers=self.workers,
+        ):
+            pass
+
+        counts = merge_token_counts(shard_paths)
+        with atomic_path(self.path(TOKEN_COUNTS)) as tmp_path:
+            counts.save(tmp_path)
+
+        self._complete('count', fingerprint, TOKEN_COUNTS, len(shard_paths))
+        return True
+
+    def distributions(self):
+        """
+        Generates token distributions for each matchup from the merged
+        token counts and compiles them into a TokenModel
+        """
+        counts_path = self._require(TOKEN_COUNTS, 'count')
+        fingerprint = _fingerprint(_hash_file(counts_path))
+        if self.is_complete('distributions', fingerprint):
+            logger.info('Token counts are unchanged, skipping distributions stage')
+            return False
+
+        counts = TokenCounts.load(counts_path)
+        matchups = list(counts.counts)
+        matchup_counts = (counts.counts[matchup] for matchup in matchups)
+
+        matchup_distributions = list(map_ordered(
+            generate_token_distributions,
+            matchup_counts,
+            workers=self.workers,
+        ))
+
+        distributions = TokenDistributions({}, {})
+        for (player_race, opp_race), matchup in zip(matchups, matchup_distributions):
+            distributions.probability.setdefault(player_race, {})[opp_race] = matchup.probability
+            distributions.information.setdefault(player_race, {})[opp_race] = matchup.information
+
+        with atomic_path(self.path(TOKEN_MODEL)) as tmp_path:
+            TokenModel.from_distributions(distributions).save(tmp_path)
+
+        self._complete('distributions', fingerprint, TOKEN_MODEL, len(matchups))
+        return True
+
+    def tokenize(self, max_token_size=4, chunksize=64):
+        """
+        Generates the optimal token path of each extracted build
+        with the model compiled by the distributions stage
+        """
+        builds_path = self._require(BUILDS, 'parse')
+        model_path = self._require(TOKEN_MODEL, 'distributions')
+        fingerprint = _fingerprint(_hash_file(builds_path), _hash_file(model_path), max_token_size)
+        if self.is_complete('tokenize', fingerprint):
+            logger.info('Builds and model are unchanged, skipping tokenize stage')
+            return False
+
+        # the model is memory-mapped, so workers share its pages
+        model = TokenModel.load(model_path)
+
+        with atomic_path(self.path(TOKENIZED_BUILDS)) as tmp_path:
+            games = write_tokenized_builds(tmp_path, tokenize_games(
+                read_builds(builds_path),
+                model=model,
+                workers=self.workers,
+                chunksize=chunksize,
+                max_token_size=max_token_size,
+            ))
+
+        self._complete('tokenize', fingerprint, TOKENIZED_BUILDS, games)
+        return True
@@ -0,0 +1,65 @@
+from collections import deque
+
+
+def imap(executor, fn, *iterables, window):
+    """
+    Lazily maps fn over iterables in an executor, yielding results in input
+    order. Unlike Executor.map, inputs are only consumed as results are,
+    so at most window tasks and their results are held at once
+    """
+    pending = deque()
+    try:
+        for args in zip(*iterables):
+            pending.append(executor.submit(fn, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def map_ordered(fn, *iterables, workers, initializer=None, initargs=()):
+    """
+    Lazily maps fn over iterables in a pool of worker processes, yielding
+    results in input order, or in this process if there are no workers.
+    At most two tasks per worker are held at once
+    """
+    if not workers:
+        yield from map(fn, *iterables)
+        return
+
+    # multiprocessing is slow to import, so only import it when it's used
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as executor:
+        yield from imap(executor, fn, *iterables, window=workers * 2)
+
+
+def optional_numpy():
+    """
+    Returns numpy, or None if it isn't installed. numpy is slow to
+    import, so it's only imported by the code that uses it
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def chunk(iterable, size):
+    """
+    Lazily splits an iterable into lists of size items
+    """
+    items = []
+    for item in iterable:
+        items.append(item)
+        if len(items) == size:
+            yield items
+            items = []
+
+    if items:
+        yield items
@@ -0,0 +1,159 @@
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+from sc2_build_tokenizer.parse import extract_builds
+from sc2_build_tokenizer.batch import tokenize_games
+from sc2_build_tokenizer.model import TokenModel
+from sc2_build_tokenizer.metrics import METRICS
+from sc2_build_tokenizer.counting import TokenCounts
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+
+class StageProfile:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.peak_memory = None
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_memory': self.peak_memory,
+            'items': self.items,
+            'unit': self.unit,
+            'throughput': self.items / self.wall_time if self.wall_time else None,
+        }
+
+
+class PipelineProfiler:
+    """
+    Records the wall time, CPU time, peak memory and throughput of each
+    stage of a pipeline.
+
+    CPU time is for the current process only, so it doesn't include
+    time spent in worker processes. Peak memory is the most memory
+    allocated by Python above the memory allocated at the start of the
+    stage, and is only recorded if trace_memory is set since tracing
+    allocations slows down everything else
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, unit):
+        """
+        Profiles a block of code as a stage. The number of items
+        processed by the stage is set on the yielded StageProfile
+        """
+        profile = StageProfile(name, unit)
+
+        started_tracing = False
+        if self.trace_memory:
+            # tracemalloc imports pickle, so only import it when tracing
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+
+        logger.info(f'Profiling stage: {name}')
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield profile
+        finally:
+            profile.wall_time = time.perf_counter() - start_wall
+            profile.cpu_time = time.process_time() - start_cpu
+
+            if self.trace_memory:
+                profile.peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+                if started_tracing:
+                    tracemalloc.stop()
+
+            self.stages.append(profile)
+
+    def report(self):
+        report = {
+            'version': REPORT_VERSION,
+            'stages': [profile.to_dict() for profile in self.stages],
+            'wall_time': sum(profile.wall_time for profile in self.stages),
+            'cpu_time': sum(profile.cpu_time for profile in self.stages),
+        }
+        if METRICS.enabled:
+            report['metrics'] = METRICS.to_dict()
+        return report
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as report:
+            json.dump(self.report(), report, indent=2)
+
+
+def profile_pipeline(
+    replays,
+    *,
+    workers=None,
+    max_token_size=4,
+    trace_memory=True,
+    report_path=None,
+):
+    """
+    Extracts builds from replays, counts their tokens, generates token
+    distributions and tokenizes the builds with them, profiling each stage.
+
+    Returns the tokenized builds of each game and the profiler, whose report
+    is also written to report_path as JSON if it is set
+    """
+    logger.info('Profiling build tokenization pipeline')
+
+    profiler = PipelineProfiler(trace_memory)
+
+    with profiler.stage('extract', 'replays') as stage:
+        games = extract_builds(replays, workers=workers)
+        stage.items = len(games)
+
+    with profiler.stage('count', 'builds') as stage:
+        token_counts = TokenCounts.from_games(games)
+        stage.items = sum(len(game) for game in games)
+
+    with profiler.stage('distributions', 'tokens') as stage:
+        distributions = token_counts.to_distributions()
+        stage.items = sum(
+            len(token_probability)
+            for other_races in distributions.probability.values()
+            for token_probability in other_races.values()
+        )
+
+    with profiler.stage('tokenize', 'paths') as stage:
+        model = TokenModel.from_distributions(distributions)
+        tokenized = list(tokenize_games(
+            games,
+            model=model,
+            workers=workers,
+            max_token_size=max_token_size,
+        ))
+        stage.items = sum(
+            tokenized_build is not None
+            for game in tokenized
+            for tokenized_build in game
+        )
+
+    if report_path is not None:
+        profiler.save(report_path)
+
+    logger.info('Completed profiling build tokenization pipeline')
+
+    return tokenized, profiler
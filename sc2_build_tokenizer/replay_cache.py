@@ -0,0 +1,87 @@
+import json
+import logging
+
+from sc2_build_tokenizer.dataclasses import ParsedBuild
+
+logger = logging.getLogger(__name__)
+
+# increment when the way buildings are extracted from replays changes,
+# so builds cached by previous versions are extracted again
+EXTRACTION_VERSION = 1
+
+
+class ReplayCache:
+    """
+    On-disk cache of the builds extracted from replay files, keyed by a hash
+    of the replay file's contents.
+
+    Builds are stored with every building in the replay, before the end
+    and ignore filters are applied, so changing either doesn't require
+    any replays to be parsed again.
+    """
+
+    def __init__(self, path):
+        # sqlite3 is only imported when a cache is used, to keep package imports fast
+        import sqlite3
+
+        self.path = str(path)
+        self._connection = sqlite3.connect(self.path)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS replay_builds (
+                    content_hash TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    builds TEXT NOT NULL
+                )
+                '''
+            )
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM replay_builds').fetchone()[0]
+
+    @staticmethod
+    def hash_replay(replay_path):
+        import hashlib
+
+        content_hash = hashlib.sha256()
+        with open(replay_path, 'rb') as replay_file:
+            for chunk in iter(lambda: replay_file.read(1 << 16), b''):
+                content_hash.update(chunk)
+        return content_hash.hexdigest()
+
+    def get(self, content_hash):
+        row = self._connection.execute(
+            'SELECT builds FROM replay_builds WHERE content_hash = ? AND version = ?',
+            (content_hash, EXTRACTION_VERSION),
+        ).fetchone()
+
+        if not row:
+            logger.debug(f'Cache miss for replay {content_hash}')
+            return None
+
+        logger.debug(f'Cache hit for replay {content_hash}')
+        builds = []
+        for build in json.loads(row[0]):
+            build['build'] = list(map(tuple, build['build']))
+            builds.append(ParsedBuild(**build))
+        return builds
+
+    def set(self, content_hash, builds):
+        with self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO replay_builds VALUES (?, ?, ?)',
+                (
+                    content_hash,
+                    EXTRACTION_VERSION,
+                    json.dumps([build.to_json() for build in builds]),
+                ),
+            )
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute('DELETE FROM replay_builds')
+
+    def close(self):
+        self._connection.close()
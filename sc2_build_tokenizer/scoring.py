@@ -0,0 +1,233 @@
+import math
+import logging
+from array import array
+from collections import namedtuple
+
+from sc2_build_tokenizer.pool import optional_numpy
+from sc2_build_tokenizer.model import TokenModel, ROOT_NODE
+from sc2_build_tokenizer.dataclasses import TokenDistributions
+from sc2_build_tokenizer import data
+
+logger = logging.getLogger(__name__)
+
+# totals are the information of each build, values and weights are the
+# information and weight of each building, aligned with the building_ids
+# of the corpus, and offsets are the corpus build_offsets into them
+BuildScores = namedtuple('BuildScores', ['totals', 'values', 'weights', 'offsets'])
+
+
+def _matchup_tokens(information, player_race, opp_race):
+    """
+    Yields the (token, information) of the unigram and bigram tokens
+    for a matchup, falling back to distributions without a matchup
+    """
+    if isinstance(information, TokenModel):
+        trie = information.trie(player_race, opp_race)
+        if trie is None:
+            return
+
+        names = information.vocabulary.names
+        for node in range(trie.child_start[ROOT_NODE], trie.child_start[ROOT_NODE + 1]):
+            building = names[trie.building[node]]
+            yield (building,), trie.information[node]
+            for child in range(trie.child_start[node], trie.child_start[node + 1]):
+                yield (building, names[trie.building[child]]), trie.information[child]
+        return
+
+    if player_race in information and opp_race in information[player_race]:
+        information = information[player_race][opp_race]
+    elif not all(isinstance(token, tuple) for token in information):
+        return
+
+    for token, token_information in information.items():
+        if len(token) <= 2:
+            yield token, token_information
+
+
+def _opp_race_ids(corpus):
+    """
+    Returns the race id of each build's opponent, or -1 for builds alone
+    in their game. Opponents are picked the same way as when counting
+    tokens, so mirror matchups are their own opponents
+    """
+    opp_race_ids = array('b', [-1]) * len(corpus)
+    for game in range(corpus.game_count):
+        start = corpus.game_offsets[game]
+        end = corpus.game_offsets[game + 1]
+        if end - start < 2:
+            continue
+
+        first = corpus.race_ids[start]
+        last = corpus.race_ids[end - 1]
+        for build in range(start, end):
+            opp_race_ids[build] = first if last == corpus.race_ids[build] else last
+    return opp_race_ids
+
+
+def _lookup_tables(corpus, information, conditional):
+    """
+    Maps the information of each matchup's unigram and bigram tokens to the
+    building ids of the corpus. Matchups are keyed by (race id, opp race id)
+    """
+    unigrams = {}
+    bigrams = {}
+    ids = corpus.vocabulary.ids
+    for race_id, player_race in enumerate(corpus.races.names):
+        for opp_race_id, opp_race in [(-1, None), *enumerate(corpus.races.names)]:
+            matchup_unigrams = {}
+            matchup_bigrams = {}
+            for token, token_information in _matchup_tokens(information, player_race, opp_race):
+                if math.isnan(token_information) or any(building not in ids for building in token):
+                    continue
+
+                if len(token) == 1:
+                    matchup_unigrams[ids[token[0]]] = token_information
+                elif conditional:
+                    matchup_bigrams[(ids[token[0]], ids[token[1]])] = token_information
+
+            unigrams[(race_id, opp_race_id)] = matchup_unigrams
+            bigrams[(race_id, opp_race_id)] = matchup_bigrams
+    return unigrams, bigrams
+
+
+def score_corpus(
+    corpus,
+    information=None,
+    *,
+    conditional=False,
+    decay=None,
+    exclude=None,
+    missing=0.0,
+):
+    """
+    Scores the information content of every build in a BuildCorpus.
+
+    Each building is scored by the information of its unigram token in the
+    build's matchup or, if conditional is set, of the bigram token with
+    the building before it, which is the information of the building
+    given that building. Bigrams that were pruned fall back to unigrams,
+    and buildings with no information in the matchup score missing.
+
+    Buildings that exclude(name) is true for are skipped, and score
+    nothing. If decay is set, the building at position i of the remaining
+    buildings is weighted by decay ** i, so early buildings count for more.
+
+    information can be nested distributions like TOKEN_INFORMATION, a
+    TokenDistributions or a TokenModel, and defaults to TOKEN_INFORMATION.
+    Scores are calculated with numpy arrays indexed by building and
+    matchup ids if numpy is installed, and returned as numpy arrays
+    """
+    if information is None:
+        information = data.TOKEN_INFORMATION
+    elif isinstance(information, TokenDistributions):
+        information = information.information
+
+    logger.info(f'Scoring information of {len(corpus)} builds')
+
+    unigrams, bigrams = _lookup_tables(corpus, information, conditional)
+    excluded = [
+        exclude is not None and bool(exclude(name))
+        for name in corpus.vocabulary.names
+    ]
+    opp_race_ids = _opp_race_ids(corpus)
+
+    np = optional_numpy()
+
+    if np is None:
+        logger.info('numpy is not installed, scoring each build')
+        return _score_builds(corpus, opp_race_ids, unigrams, bigrams, excluded, decay, missing)
+
+    races = len(corpus.races)
+    buildings = len(corpus.vocabulary)
+
+    # matchup tables are indexed by opp race id + 1, so builds
+    # without an opponent use the distributions without a matchup
+    unigram_table = np.full((races, races + 1, buildings), np.nan)
+    for (race_id, opp_race_id), matchup_unigrams in unigrams.items():
+        if matchup_unigrams:
+            unigram_table[race_id, opp_race_id + 1, list(matchup_unigrams)] = list(matchup_unigrams.values())
+
+    # corpus arrays are read through their buffers rather than copied
+    building_ids = _as_numpy(np, corpus.building_ids)
+    offsets = _as_numpy(np, corpus.build_offsets)
+    build_index = np.repeat(np.arange(len(corpus)), np.diff(offsets))
+
+    included = ~np.array(excluded, dtype=bool)[building_ids] if building_ids.size else np.zeros(0, dtype=bool)
+    included_ids = building_ids[included]
+    included_builds = build_index[included]
+
+    # tables are looked up by flat indexes, with a row for each matchup
+    build_matchups = (
+        _as_numpy(np, corpus.race_ids).astype(np.int64) * (races + 1)
+        + _as_numpy(np, opp_race_ids).astype(np.int64) + 1
+    )
+    matchups = build_matchups[included_builds]
+    included_values = unigram_table.reshape(-1)[matchups * buildings + included_ids]
+
+    # the position of each remaining building in its build
+    included_before = np.concatenate(([0], np.cumsum(included)))
+    build_starts = included_before[offsets[:-1]]
+    positions = np.arange(included_ids.size) - build_starts[included_builds]
+
+    if conditional and included_ids.size:
+        bigram_table = np.full((races, races + 1, buildings, buildings), np.nan)
+        for (race_id, opp_race_id), matchup_bigrams in bigrams.items():
+            if matchup_bigrams:
+                previous, predicted = zip(*matchup_bigrams)
+                bigram_table[race_id, opp_race_id + 1, list(previous), list(predicted)] = list(matchup_bigrams.values())
+
+        previous_ids = np.roll(included_ids, 1)
+        conditional_values = bigram_table.reshape(-1)[(matchups * buildings + previous_ids) * buildings + included_ids]
+        conditional_values[positions == 0] = np.nan
+        included_values = np.where(np.isnan(conditional_values), included_values, conditional_values)
+
+    included_values[np.isnan(included_values)] = missing
+    included_weights = np.ones(included_ids.size) if decay is None else np.power(float(decay), positions)
+
+    values = np.zeros(building_ids.size)
+    weights = np.zeros(building_ids.size)
+    values[included] = included_values
+    weights[included] = included_weights
+    totals = np.bincount(build_index, weights=values * weights, minlength=len(corpus))
+
+    # offsets are copied so the corpus arrays aren't held by the scores
+    return BuildScores(totals, values, weights, offsets.copy())
+
+
+def _as_numpy(np, values):
+    if not len(values):
+        return np.zeros(0, dtype=f'{values.typecode}')
+    return np.frombuffer(values, dtype=values.typecode)
+
+
+def _score_builds(corpus, opp_race_ids, unigrams, bigrams, excluded, decay, missing):
+    totals = array('d')
+    values = array('d', [0.0]) * len(corpus.building_ids)
+    weights = array('d', [0.0]) * len(corpus.building_ids)
+
+    for build in range(len(corpus)):
+        matchup = (corpus.race_ids[build], opp_race_ids[build])
+        matchup_unigrams = unigrams[matchup]
+        matchup_bigrams = bigrams[matchup]
+
+        total = 0
+        position = 0
+        previous_id = None
+        for index in range(corpus.build_offsets[build], corpus.build_offsets[build + 1]):
+            building_id = corpus.building_ids[index]
+            if excluded[building_id]:
+                continue
+
+            value = matchup_bigrams.get((previous_id, building_id))
+            if value is None:
+                value = matchup_unigrams.get(building_id, missing)
+            weight = 1.0 if decay is None else decay ** position
+
+            values[index] = value
+            weights[index] = weight
+            total += value * weight
+            position += 1
+            previous_id = building_id
+        totals.append(total)
+
+    return BuildScores(totals, values, weights, array('q', corpus.build_offsets))
@@ -0,0 +1,459 @@
+"""
+Streaming readers and writers for parsed builds, tokenized builds and token
+distributions, as newline-delimited JSON or a compact binary encoding.
+
+Records are written and read one at a time, so corpora don't need to fit in
+memory to be exported or imported. Building names are interned as ids, with
+new names written to the file as they first appear, so tokens are encoded
+as lists of small integers rather than tuples of strings.
+"""
+import sys
+import json
+import struct
+import logging
+from array import array
+
+from sc2_build_tokenizer.model import Vocabulary, _is_flat_distribution
+from sc2_build_tokenizer.dataclasses import (
+    ParsedBuild,
+    TokenizedBuild,
+    TokenDistributions,
+)
+
+logger = logging.getLogger(__name__)
+
+BUILDS_MAGIC = b'SC2BLDS\x00'
+TOKENIZED_MAGIC = b'SC2TOKS\x00'
+DISTRIBUTIONS_MAGIC = b'SC2DIST\x00'
+STREAM_VERSION = 1
+
+# binary files are a header of magic and version followed by
+# records of a type, payload length and payload
+HEADER_FORMAT = '<8sI'
+RECORD_FORMAT = '<BI'
+
+NAMES_RECORD = 1
+GAME_RECORD = 2
+TOKENIZED_GAME_RECORD = 3
+MATCHUP_RECORD = 4
+TOKEN_RECORD = 5
+
+# binary values are always little endian
+SWAP_BYTES = sys.byteorder != 'little'
+
+
+def _array_bytes(typecode, values):
+    values = array(typecode, values)
+    if SWAP_BYTES:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _bytes_array(typecode, payload, offset, length):
+    values = array(typecode)
+    size = length * values.itemsize
+    values.frombytes(payload[offset:offset + size])
+    if SWAP_BYTES:
+        values.byteswap()
+    return values, offset + size
+
+
+def _pack_string(value):
+    encoded = value.encode('utf-8')
+    return struct.pack('<I', len(encoded)) + encoded
+
+
+def _unpack_string(payload, offset):
+    length, = struct.unpack_from('<I', payload, offset)
+    offset += 4
+    return bytes(payload[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def _pack_optional_string(value):
+    return _pack_string(value) if value is not None else struct.pack('<I', 0xFFFFFFFF)
+
+
+def _unpack_optional_string(payload, offset):
+    length, = struct.unpack_from('<I', payload, offset)
+    if length == 0xFFFFFFFF:
+        return None, offset + 4
+    return _unpack_string(payload, offset)
+
+
+class _StreamWriter:
+    """
+    Writes records to a file, adding names to the
+    file's vocabulary as they're first used
+    """
+
+    def __init__(self, path, magic, binary):
+        self.binary = binary
+        self.vocabulary = Vocabulary()
+        self.file = open(path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8')
+        if binary:
+            self.file.write(struct.pack(HEADER_FORMAT, magic, STREAM_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def intern(self, names):
+        new_names = [name for name in dict.fromkeys(names) if name not in self.vocabulary]
+        if new_names:
+            for name in new_names:
+                self.vocabulary.intern(name)
+
+            if self.binary:
+                self.write(NAMES_RECORD, b''.join(map(_pack_string, new_names)))
+            else:
+                self.write({'names': new_names})
+
+        return [self.vocabulary.ids[name] for name in names]
+
+    def write(self, record_type, payload=None):
+        if not self.binary:
+            # JSON records are passed in place of the record type
+            self.file.write(json.dumps(record_type, separators=(',', ':')))
+            self.file.write('\n')
+            return
+
+        self.file.write(struct.pack(RECORD_FORMAT, record_type, len(payload)))
+        self.file.write(payload)
+
+
+def _read_records(path, magic):
+    """
+    Yields the type and payload of each record in a binary file, or the
+    record type and object of each line in an NDJSON file. Names records
+    are read into a vocabulary, which is yielded first
+    """
+    vocabulary = Vocabulary()
+    yield vocabulary
+
+    with open(path, 'rb') as stream:
+        header = stream.read(struct.calcsize(HEADER_FORMAT))
+        if header[:len(magic)] == magic:
+            _, version = struct.unpack(HEADER_FORMAT, header)
+            if version != STREAM_VERSION:
+                raise ValueError(f'Unsupported stream version {version}: {path}')
+
+            record_size = struct.calcsize(RECORD_FORMAT)
+            while True:
+                record_header = stream.read(record_size)
+                if not record_header:
+                    return
+                if len(record_header) < record_size:
+                    raise ValueError(f'Truncated record in {path}')
+
+                record_type, length = struct.unpack(RECORD_FORMAT, record_header)
+                payload = stream.read(length)
+                if len(payload) < length:
+                    raise ValueError(f'Truncated record in {path}')
+
+                if record_type == NAMES_RECORD:
+                    offset = 0
+                    while offset < length:
+                        name, offset = _unpack_string(payload, offset)
+                        vocabulary.intern(name)
+                    continue
+
+                yield record_type, memoryview(payload)
+            return
+
+        stream.seek(0)
+        for line in stream:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            if isinstance(record, dict) and 'names' in record:
+                for name in record['names']:
+                    vocabulary.intern(name)
+                continue
+
+            yield None, record
+
+
+def write_builds(path, games, binary=False):
+    """
+    Writes games of ParsedBuilds, one game per record. NDJSON games are
+    written as lists of ParsedBuild.to_json dicts so they can be read
+    without this module
+    """
+    count = 0
+    with _StreamWriter(path, BUILDS_MAGIC, binary) as writer:
+        for game in games:
+            if not binary:
+                writer.write([build.to_json() for build in game])
+                count += 1
+                continue
+
+            payload = bytearray(struct.pack('<I', len(game)))
+            for build in game:
+                building_ids = writer.intern([building for building, _ in build.build])
+                payload += _pack_string(build.race)
+                payload += _pack_string(build.player)
+                payload += _pack_optional_string(build.game_map)
+                payload += struct.pack(
+                    '<qqBI',
+                    build.game_length,
+                    build.max_collection_rate,
+                    build.win,
+                    len(building_ids),
+                )
+                payload += _array_bytes('i', building_ids)
+                payload += _array_bytes('i', [gameloop for _, gameloop in build.build])
+
+            writer.write(GAME_RECORD, payload)
+            count += 1
+
+    logger.info(f'Wrote {count} games of builds: {path}')
+    return count
+
+
+def read_builds(path):
+    """
+    Lazily reads games of ParsedBuilds written as NDJSON or binary
+    """
+    records = _read_records(path, BUILDS_MAGIC)
+    vocabulary = next(records)
+
+    for record_type, record in records:
+        if record_type is None:
+            game = []
+            for build in record:
+                build['build'] = list(map(tuple, build['build']))
+                game.append(ParsedBuild(**build))
+            yield game
+            continue
+
+        build_count, = struct.unpack_from('<I', record, 0)
+        offset = 4
+        game = []
+        for _ in range(build_count):
+            race, offset = _unpack_string(record, offset)
+            player, offset = _unpack_string(record, offset)
+            game_map, offset = _unpack_optional_string(record, offset)
+            game_length, max_collection_rate, win, length = struct.unpack_from('<qqBI', record, offset)
+            offset += struct.calcsize('<qqBI')
+            building_ids, offset = _bytes_array('i', record, offset, length)
+            gameloops, offset = _bytes_array('i', record, offset, length)
+
+            game.append(ParsedBuild(
+                race,
+                player,
+                game_map,
+                game_length,
+                max_collection_rate,
+                bool(win),
+                list(zip(vocabulary.decode(building_ids), gameloops)),
+            ))
+        yield game
+
+
+def write_tokenized_builds(path, games, binary=False):
+    """
+    Writes games of TokenizedBuilds, one game per record. Builds that
+    couldn't be tokenized are written as None. Tokens are written as
+    lists of building ids
+    """
+    count = 0
+    with _StreamWriter(path, TOKENIZED_MAGIC, binary) as writer:
+        for game in games:
+            if not binary:
+                records = []
+                for tokenized_build in game:
+                    if tokenized_build is None:
+                        records.append(None)
+                        continue
+
+                    record = tokenized_build.to_json()
+                    record['tokens'] = [writer.intern(token) for token in tokenized_build.tokens]
+                    records.append(record)
+
+                writer.write(records)
+                count += 1
+                continue
+
+            payload = bytearray(struct.pack('<I', len(game)))
+            for tokenized_build in game:
+                if tokenized_build is None:
+                    payload += struct.pack('<B', 0)
+                    continue
+
+                token_ids = [writer.intern(token) for token in tokenized_build.tokens]
+                payload += struct.pack('<B', 1)
+                payload += _pack_string(tokenized_build.race)
+                payload += _pack_string(tokenized_build.player)
+                payload += struct.pack(
+                    '<qddII',
+                    tokenized_build.max_collection_rate,
+                    tokenized_build.probability,
+                    tokenized_build.information,
+                    len(token_ids),
+                    len(tokenized_build.probability_values),
+                )
+                payload += _array_bytes('I', [len(token) for token in token_ids])
+                payload += _array_bytes('i', [building_id for token in token_ids for building_id in token])
+                payload += _array_bytes('d', tokenized_build.probability_values)
+                payload += _array_bytes('d', tokenized_build.information_values)
+
+            writer.write(TOKENIZED_GAME_RECORD, payload)
+            count += 1
+
+    logger.info(f'Wrote {count} games of tokenized builds: {path}')
+    return count
+
+
+def read_tokenized_builds(path):
+    """
+    Lazily reads games of TokenizedBuilds written as NDJSON or binary
+    """
+    records = _read_records(path, TOKENIZED_MAGIC)
+    vocabulary = next(records)
+
+    for record_type, record in records:
+        if record_type is None:
+            game = []
+            for tokenized_build in record:
+                if tokenized_build is not None:
+                    tokenized_build['tokens'] = list(map(vocabulary.decode, tokenized_build['tokens']))
+                    tokenized_build = TokenizedBuild(**tokenized_build)
+                game.append(tokenized_build)
+            yield game
+            continue
+
+        build_count, = struct.unpack_from('<I', record, 0)
+        offset = 4
+        game = []
+        for _ in range(build_count):
+            tokenized, = struct.unpack_from('<B', record, offset)
+            offset += 1
+            if not tokenized:
+                game.append(None)
+                continue
+
+            race, offset = _unpack_string(record, offset)
+            player, offset = _unpack_string(record, offset)
+            (
+                max_collection_rate,
+                probability,
+                information,
+                token_count,
+                length,
+            ) = struct.unpack_from('<qddII', record, offset)
+            offset += struct.calcsize('<qddII')
+            token_sizes, offset = _bytes_array('I', record, offset, token_count)
+            building_ids, offset = _bytes_array('i', record, offset, length)
+            probability_values, offset = _bytes_array('d', record, offset, length)
+            information_values, offset = _bytes_array('d', record, offset, length)
+
+            tokens = []
+            start = 0
+            for size in token_sizes:
+                tokens.append(vocabulary.decode(building_ids[start:start + size]))
+                start += size
+
+            game.append(TokenizedBuild(
+                race,
+                player,
+                max_collection_rate,
+                tokens,
+                probability,
+                probability_values.tolist(),
+                information,
+                information_values.tolist(),
+            ))
+        yield game
+
+
+def _iter_matchup_distributions(distributions):
+    if _is_flat_distribution(distributions.probability):
+        yield None, None, distributions.probability, distributions.information
+        return
+
+    for player_race, other_races in distributions.probability.items():
+        for opp_race, token_probability in other_races.items():
+            yield player_race, opp_race, token_probability, distributions.information[player_race][opp_race]
+
+
+def write_distributions(path, distributions, binary=False):
+    """
+    Writes token distributions for a single matchup, or nested by player race
+    and opponent race, as a matchup record followed by a record for each token
+    """
+    count = 0
+    with _StreamWriter(path, DISTRIBUTIONS_MAGIC, binary) as writer:
+        for player_race, opp_race, token_probability, token_information in _iter_matchup_distributions(distributions):
+            if binary:
+                writer.write(
+                    MATCHUP_RECORD,
+                    _pack_optional_string(player_race) + _pack_optional_string(opp_race),
+                )
+            else:
+                writer.write({'matchup': [player_race, opp_race]})
+
+            for token, probability in token_probability.items():
+                token_ids = writer.intern(token)
+                if binary:
+                    writer.write(TOKEN_RECORD, b''.join([
+                        struct.pack('<dd', probability, token_information[token]),
+                        _array_bytes('i', token_ids),
+                    ]))
+                else:
+                    writer.write([token_ids, probability, token_information[token]])
+                count += 1
+
+    logger.info(f'Wrote {count} token distribution records: {path}')
+    return count
+
+
+def read_distributions(path):
+    """
+    Lazily reads the player race, opponent race, token, probability and
+    information of each token. The races are None for distributions
+    written without a matchup
+    """
+    records = _read_records(path, DISTRIBUTIONS_MAGIC)
+    vocabulary = next(records)
+
+    player_race = opp_race = None
+    for record_type, record in records:
+        if record_type is None:
+            if isinstance(record, dict):
+                player_race, opp_race = record['matchup']
+                continue
+
+            token_ids, probability, information = record
+            yield player_race, opp_race, vocabulary.decode(token_ids), probability, information
+            continue
+
+        if record_type == MATCHUP_RECORD:
+            player_race, offset = _unpack_optional_string(record, 0)
+            opp_race, _ = _unpack_optional_string(record, offset)
+            continue
+
+        probability, information = struct.unpack_from('<dd', record, 0)
+        offset = struct.calcsize('<dd')
+        token_ids, _ = _bytes_array('i', record, offset, (len(record) - offset) // 4)
+        yield player_race, opp_race, vocabulary.decode(token_ids), probability, information
+
+
+def load_distributions(path):
+    """
+    Reads token distributions into a TokenDistributions object,
+    nested by matchup unless they were written without one
+    """
+    distributions = TokenDistributions({}, {})
+    for player_race, opp_race, token, probability, information in read_distributions(path):
+        if player_race is None and opp_race is None:
+            distributions.probability[token] = probability
+            distributions.information[token] = information
+            continue
+
+        distributions.probability.setdefault(player_race, {}).setdefault(opp_race, {})[token] = probability
+        distributions.information.setdefault(player_race, {}).setdefault(opp_race, {})[token] = information
+
+    return distributions
@@ -0,0 +1,184 @@
+import zlib
+import random
+import logging
+from collections import defaultdict
+
+from sc2_build_tokenizer.pool import optional_numpy
+
+logger = logging.getLogger(__name__)
+
+# hashes are reduced mod a prime small enough that
+# a * hash + b fits in 64 bits, so numpy can compute them
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = MERSENNE_PRIME
+
+
+def _build_sequence(build):
+    """
+    Returns the tokens of a tokenized build, or the buildings of a parsed
+    build. Anything else is treated as a sequence of buildings
+    """
+    if hasattr(build, 'tokens'):
+        return tuple(map(tuple, build.tokens))
+    if hasattr(build, 'buildings'):
+        return tuple(build.buildings)
+    if hasattr(build, 'build'):
+        return tuple(building for building, _ in build.build)
+    return tuple(build)
+
+
+def shingles(sequence, size=2):
+    """
+    Returns the set of contiguous subsequences of a size in a sequence,
+    or the whole sequence if it's shorter than the size
+    """
+    if not sequence:
+        return set()
+    if len(sequence) <= size:
+        return {tuple(sequence)}
+    return {tuple(sequence[i:i + size]) for i in range(len(sequence) - size + 1)}
+
+
+def jaccard_similarity(shingles, other_shingles):
+    if not shingles and not other_shingles:
+        return 1.0
+    return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+
+def _hash_shingle(shingle):
+    # the builtin hash of strings changes between processes,
+    # so signatures wouldn't be comparable across runs
+    return zlib.crc32(repr(shingle).encode('utf-8')) % MERSENNE_PRIME
+
+
+class BuildIndex:
+    """
+    Approximate nearest neighbour index of builds, using MinHash signatures
+    of the shingles of each build and locality-sensitive hashing.
+
+    Signatures are split into bands, and builds are candidates for each
+    other if all the values in any band match. Builds with a Jaccard
+    similarity s share a band with probability 1 - (1 - s^r)^b for b bands
+    of r rows, so more bands find less similar builds at the cost of more
+    candidates. Candidates are then scored exactly.
+
+    Builds can be parsed builds, tokenized builds, row views of either, or
+    sequences of buildings. Tokenized builds are compared by their tokens
+    """
+
+    def __init__(self, num_perm=128, bands=32, shingle_size=2, seed=0):
+        if num_perm % bands:
+            raise ValueError(f'{bands} bands do not evenly divide {num_perm} permutations')
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = random.Random(seed)
+        self._a = [rng.randrange(1, MERSENNE_PRIME) for _ in range(num_perm)]
+        self._b = [rng.randrange(0, MERSENNE_PRIME) for _ in range(num_perm)]
+
+        self.keys = []
+        self.sequences = []
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+
+        np = optional_numpy()
+        self._np = np
+        if np is not None:
+            self._a = np.array(self._a, dtype=np.uint64)
+            self._b = np.array(self._b, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def signature(self, build):
+        """
+        Returns the MinHash signature of a build as a tuple of num_perm values
+        """
+        return self._signature(shingles(_build_sequence(build), self.shingle_size))
+
+    def _signature(self, build_shingles):
+        if not build_shingles:
+            return (MAX_HASH,) * self.num_perm
+
+        hashes = [_hash_shingle(shingle) for shingle in build_shingles]
+
+        np = self._np
+        if np is not None:
+            hashes = np.array(hashes, dtype=np.uint64)
+            permuted = (np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME
+            return tuple(permuted.min(axis=1).tolist())
+
+        return tuple(
+            min((a * value + b) % MERSENNE_PRIME for value in hashes)
+            for a, b in zip(self._a, self._b)
+        )
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def add(self, build, key=None):
+        """
+        Adds a build to the index, returning its id. The key is returned with
+        the build in query results, and defaults to the build's id
+        """
+        build_id = len(self.keys)
+        sequence = _build_sequence(build)
+        self.keys.append(key if key is not None else build_id)
+        self.sequences.append(sequence)
+
+        build_shingles = shingles(sequence, self.shingle_size)
+        if build_shingles:
+            for band, band_key in self._band_keys(self._signature(build_shingles)):
+                self._buckets[band][band_key].append(build_id)
+
+        return build_id
+
+    def update(self, builds, keys=None):
+        """
+        Adds builds to the index, returning their ids
+        """
+        if keys is None:
+            return [self.add(build) for build in builds]
+        return [self.add(build, key) for build, key in zip(builds, keys)]
+
+    def candidates(self, build):
+        """
+        Returns the ids of builds that share at least one band with a build
+        """
+        build_shingles = shingles(_build_sequence(build), self.shingle_size)
+        if not build_shingles:
+            return set()
+
+        candidate_ids = set()
+        for band, band_key in self._band_keys(self._signature(build_shingles)):
+            candidate_ids.update(self._buckets[band].get(band_key, ()))
+        return candidate_ids
+
+    def query(self, build, k=10, threshold=None, score=None):
+        """
+        Returns up to k (similarity, key) tuples of the builds most similar
+        to a build, in order of decreasing similarity.
+
+        Only candidates are scored, by the exact Jaccard similarity of their
+        shingles or by score(sequence, other_sequence) if it's supplied.
+        Builds less similar than threshold are excluded
+        """
+        sequence = _build_sequence(build)
+        build_shingles = shingles(sequence, self.shingle_size)
+
+        scored = []
+        for build_id in self.candidates(sequence):
+            other = self.sequences[build_id]
+            if score is not None:
+                similarity = score(sequence, other)
+            else:
+                similarity = jaccard_similarity(build_shingles, shingles(other, self.shingle_size))
+
+            if threshold is None or similarity >= threshold:
+                scored.append((similarity, build_id))
+
+        scored.sort(key=lambda match: (-match[0], match[1]))
+        return [(similarity, self.keys[build_id]) for similarity, build_id in scored[:k]]
@@ -0,0 +1,333 @@
+import json
+import logging
+
+from sc2_build_tokenizer.dataclasses import ParsedBuild, TokenizedBuild
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS builds (
+        id INTEGER PRIMARY KEY,
+        game_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        race TEXT NOT NULL,
+        opp_race TEXT,
+        player TEXT NOT NULL,
+        game_map TEXT,
+        game_length INTEGER,
+        max_collection_rate INTEGER,
+        win INTEGER NOT NULL,
+        build TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tokenized_builds (
+        build_id INTEGER PRIMARY KEY REFERENCES builds (id),
+        tokens TEXT NOT NULL,
+        probability REAL NOT NULL,
+        probability_values TEXT NOT NULL,
+        information REAL NOT NULL,
+        information_values TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS tokens (
+        id INTEGER PRIMARY KEY,
+        token TEXT NOT NULL UNIQUE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS token_postings (
+        token_id INTEGER NOT NULL REFERENCES tokens (id),
+        build_id INTEGER NOT NULL REFERENCES builds (id),
+        position INTEGER NOT NULL,
+        PRIMARY KEY (token_id, build_id, position)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS builds_game ON builds (game_id, position)',
+    'CREATE INDEX IF NOT EXISTS builds_matchup ON builds (race, opp_race, win)',
+    'CREATE INDEX IF NOT EXISTS builds_player ON builds (player, race)',
+    'CREATE INDEX IF NOT EXISTS builds_map ON builds (game_map)',
+    'CREATE INDEX IF NOT EXISTS builds_collection_rate ON builds (max_collection_rate)',
+    'CREATE INDEX IF NOT EXISTS token_postings_build ON token_postings (build_id)',
+]
+
+BUILD_COLUMNS = 'builds.race, builds.player, builds.game_map, builds.game_length, builds.max_collection_rate, builds.win, builds.build'
+TOKENIZED_COLUMNS = (
+    'builds.race, builds.player, builds.max_collection_rate, tokenized_builds.tokens, '
+    'tokenized_builds.probability, tokenized_builds.probability_values, '
+    'tokenized_builds.information, tokenized_builds.information_values'
+)
+
+
+def _encode_token(token):
+    return json.dumps(list(token), separators=(',', ':'))
+
+
+class CorpusStore:
+    """
+    SQLite store of parsed builds and their tokenized builds, indexed by
+    matchup, player, map and collection rate, with postings of the builds
+    each token appears in.
+
+    Queries return ParsedBuilds or TokenizedBuilds lazily as rows are read,
+    so results don't need to fit in memory
+    """
+
+    def __init__(self, path):
+        # sqlite3 is only imported when a store is used, to keep package imports fast
+        import sqlite3
+
+        self.path = str(path)
+        self._connection = sqlite3.connect(self.path)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+
+        # ids of tokens already in the store, so adding
+        # tokenized builds doesn't query them every time
+        self._token_ids = {}
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM builds').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def _next_game_id(self):
+        return self._connection.execute('SELECT COALESCE(MAX(game_id), -1) + 1 FROM builds').fetchone()[0]
+
+    def _token_id(self, token):
+        encoded = _encode_token(token)
+        if encoded not in self._token_ids:
+            self._connection.execute('INSERT OR IGNORE INTO tokens (token) VALUES (?)', (encoded,))
+            self._token_ids[encoded] = self._connection.execute(
+                'SELECT id FROM tokens WHERE token = ?',
+                (encoded,),
+            ).fetchone()[0]
+        return self._token_ids[encoded]
+
+    def _add_game(self, game_id, parsed_game, tokenized_game):
+        races = [build.race for build in parsed_game]
+        if tokenized_game is None:
+            tokenized_game = [None] * len(parsed_game)
+
+        for position, (build, tokenized_build) in enumerate(zip(parsed_game, tokenized_game)):
+            opp_race = races[0] if races[-1] == build.race else races[-1]
+            build_id = self._connection.execute(
+                '''
+                INSERT INTO builds (
+                    game_id, position, race, opp_race, player, game_map,
+                    game_length, max_collection_rate, win, build
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (
+                    game_id,
+                    position,
+                    build.race,
+                    opp_race if len(races) > 1 else None,
+                    build.player,
+                    build.game_map,
+                    build.game_length,
+                    build.max_collection_rate,
+                    build.win,
+                    json.dumps(build.build, separators=(',', ':')),
+                ),
+            ).lastrowid
+
+            if tokenized_build is None:
+                continue
+
+            self._connection.execute(
+                'INSERT INTO tokenized_builds VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    build_id,
+                    json.dumps(tokenized_build.tokens, separators=(',', ':')),
+                    tokenized_build.probability,
+                    json.dumps(tokenized_build.probability_values),
+                    tokenized_build.information,
+                    json.dumps(tokenized_build.information_values),
+                ),
+            )
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO token_postings VALUES (?, ?, ?)',
+                [
+                    (self._token_id(token), build_id, token_position)
+                    for token_position, token in enumerate(tokenized_build.tokens)
+                ],
+            )
+
+    def add_game(self, parsed_game, tokenized_game=None):
+        """
+        Adds the parsed builds of a game, and their tokenized builds in the
+        same order if they're supplied, returning the id of the game
+        """
+        try:
+            with self._connection:
+                game_id = self._next_game_id()
+                self._add_game(game_id, parsed_game, tokenized_game)
+        except Exception:
+            # tokens added in the transaction were rolled back
+            self._token_ids.clear()
+            raise
+        return game_id
+
+    def add_games(self, parsed_games, tokenized_games=None):
+        """
+        Adds games in a single transaction, which is much faster than
+        adding them one at a time. Returns the number of games added
+        """
+        if tokenized_games is None:
+            tokenized_games = iter(lambda: None, 0)
+
+        count = 0
+        try:
+            with self._connection:
+                game_id = self._next_game_id()
+                for parsed_game, tokenized_game in zip(parsed_games, tokenized_games):
+                    self._add_game(game_id + count, parsed_game, tokenized_game)
+                    count += 1
+        except Exception:
+            self._token_ids.clear()
+            raise
+
+        logger.info(f'Added {count} games to corpus store')
+        return count
+
+    @staticmethod
+    def _where(
+        race=None,
+        opp_race=None,
+        player=None,
+        game_map=None,
+        win=None,
+        min_collection_rate=None,
+        token=None,
+    ):
+        conditions = []
+        params = []
+        for column, value in [
+            ('builds.race', race),
+            ('builds.opp_race', opp_race),
+            ('builds.player', player),
+            ('builds.game_map', game_map),
+        ]:
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+
+        if win is not None:
+            conditions.append('builds.win = ?')
+            params.append(int(win))
+
+        if min_collection_rate is not None:
+            conditions.append('builds.max_collection_rate >= ?')
+            params.append(min_collection_rate)
+
+        if token is not None:
+            conditions.append(
+                '''
+                builds.id IN (
+                    SELECT token_postings.build_id
+                    FROM token_postings JOIN tokens ON tokens.id = token_postings.token_id
+                    WHERE tokens.token = ?
+                )
+                '''
+            )
+            params.append(_encode_token(token))
+
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        return where, params
+
+    def count(self, **filters):
+        """
+        Counts the builds matching filters, which are the same as query_builds
+        """
+        where, params = self._where(**filters)
+        return self._connection.execute(f'SELECT COUNT(*) FROM builds {where}', params).fetchone()[0]
+
+    def query_builds(self, *, limit=None, **filters):
+        """
+        Lazily yields the ParsedBuilds matching every filter supplied. Builds
+        can be filtered by race, opp_race, player, game_map, win, a minimum
+        max_collection_rate with min_collection_rate, and a token their
+        tokenized build contains
+        """
+        where, params = self._where(**filters)
+        query = f'SELECT {BUILD_COLUMNS} FROM builds {where} ORDER BY builds.id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        for race, player, game_map, game_length, max_collection_rate, win, build in self._connection.execute(query, params):
+            yield ParsedBuild(
+                race,
+                player,
+                game_map,
+                game_length,
+                max_collection_rate,
+                bool(win),
+                list(map(tuple, json.loads(build))),
+            )
+
+    def query_tokenized_builds(self, *, limit=None, **filters):
+        """
+        Lazily yields the TokenizedBuilds of the builds matching
+        filters, which are the same as query_builds
+        """
+        where, params = self._where(**filters)
+        query = (
+            f'SELECT {TOKENIZED_COLUMNS} FROM builds '
+            f'JOIN tokenized_builds ON tokenized_builds.build_id = builds.id {where} '
+            'ORDER BY builds.id'
+        )
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        for (
+            race,
+            player,
+            max_collection_rate,
+            tokens,
+            probability,
+            probability_values,
+            information,
+            information_values,
+        ) in self._connection.execute(query, params):
+            yield TokenizedBuild(
+                race,
+                player,
+                max_collection_rate,
+                list(map(tuple, json.loads(tokens))),
+                probability,
+                json.loads(probability_values),
+                information,
+                json.loads(information_values),
+            )
+
+    def token_counts(self, *, limit=None, **filters):
+        """
+        Returns (token, build count) tuples of the tokens in the tokenized
+        builds matching filters, in order of decreasing count
+        """
+        where, params = self._where(**filters)
+        query = f'''
+            SELECT tokens.token, COUNT(DISTINCT token_postings.build_id) AS build_count
+            FROM token_postings
+            JOIN tokens ON tokens.id = token_postings.token_id
+            JOIN builds ON builds.id = token_postings.build_id
+            {where}
+            GROUP BY tokens.id
+            ORDER BY build_count DESC
+        '''
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        return [
+            (tuple(json.loads(token)), build_count)
+            for token, build_count in self._connection.execute(query, params)
+        ]
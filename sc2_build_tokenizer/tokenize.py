@@ -1,47 +1,54 @@
 import copy
 import math
+import heapq
 import logging
+import itertools
 from collections import defaultdict
 
+from sc2_build_tokenizer.cache import FragmentCache
+from sc2_build_tokenizer.metrics import METRICS
+from sc2_build_tokenizer.model import ROOT_NODE, MISSING_NODE
 from sc2_build_tokenizer.dataclasses import (
     TokenizedBuild,
     TokenDistributions,
 )
-from sc2_build_tokenizer.data import TOKEN_PROBABILITY
-from sc2_build_tokenizer.data import TOKEN_INFORMATION
-
-CACHED_TOKEN_PROBABILITY = {}
-CACHED_TOKEN_INFORMATION = {}
-
-CACHED_PROBABILITY_VALUES = {}
-CACHED_INFORMATION_VALUES = {}
+from sc2_build_tokenizer import data
 
 logger = logging.getLogger(__name__)
 
+# 10 is an arbitrary minimum number of samples
+# to reduce overfitting paths based on a few samples
+MIN_NGRAM_SAMPLES = 10
 
-def generate_build_tokens(build, source=None):
+
+def generate_build_tokens(build, source=None, vocabulary=None, max_token_size=8):
     logger.info('Generating tokens from parsed build')
 
-    build_tokens = source
-    buildings = list(map(lambda x: x[0], build))
-    if not source:
-        logger.info('No source supplied, recording token counts locally')
-        build_tokens = defaultdict(int)
-
-    logger.info('Iterating through build')
-    for i in range(0, len(buildings)):
-        logger.debug(f'Generating tokens for {buildings[i]} (Index: {i})')
-        for index in range(1, 9):
-            token = tuple(buildings[i:i + index])
-            logger.debug(f'Found token: {token}')
-
-            build_tokens[token] += 1
-            logger.debug(f'Incrementing token count to {build_tokens[token]}')
-
-            # exit if we're at the end of the build
-            if i + index >= len(buildings):
-                logger.debug('Reached end of build')
-                break
+    with METRICS.stage('generate_build_tokens'):
+        build_tokens = source
+        buildings = list(map(lambda x: x[0], build))
+
+        # record tokens as building ids, which can be compiled into a TokenModel
+        # sharing the vocabulary without converting them back to names
+        if vocabulary is not None:
+            buildings = list(map(vocabulary.intern, buildings))
+        if not source:
+            logger.info('No source supplied, recording token counts locally')
+            build_tokens = defaultdict(int)
+
+        for i in range(0, len(buildings)):
+            for index in range(1, max_token_size + 1):
+                token = tuple(buildings[i:i + index])
+                build_tokens[token] += 1
+
+                # exit if we're at the end of the build
+                if i + index >= len(buildings):
+                    break
+
+        if METRICS.enabled:
+            METRICS.increment('tokens_counted', sum(
+                min(max_token_size, len(buildings) - i) for i in range(len(buildings))
+            ))
 
     logger.info('Completed generating build tokens')
 
@@ -49,68 +56,52 @@ def generate_build_tokens(build, source=None):
 
 
 def generate_token_distributions(source):
-    logging.info('Generating token distributions from token counts')
-
-    distributions = TokenDistributions({}, {})
-    tokenized = list(source.items())
-    unigrams = {}
-    ngram_tokens = defaultdict(dict)
-
-    # unigrams are a special case because they have no corresponding
-    # predicted token. It's easier to store them separately
-    logger.info('Iterating through generated tokens')
-    for token, count in tokenized:
-        if len(token) == 1:
-            unigrams[token] = count
-            logger.debug(f'Setting unigram token {token} to {count}')
-            continue
+    logger.info('Generating token distributions from token counts')
 
-        ngram = token[:-1]
-        predicted = token[-1]
+    with METRICS.stage('generate_token_distributions'):
+        distributions = TokenDistributions({}, {})
+        tokenized = list(source.items())
+        unigrams = {}
+        ngram_tokens = defaultdict(dict)
 
-        ngram_tokens[ngram][predicted] = count
-        logger.debug(f'Setting ngram token {token} to {count}')
+        # unigrams are a special case because they have no corresponding
+        # predicted token. It's easier to store them separately
+        for token, count in tokenized:
+            if len(token) == 1:
+                unigrams[token] = count
+                continue
 
-    logger.info('Calculating probabilities and information content for unigram tokens')
+            ngram = token[:-1]
+            predicted = token[-1]
 
-    total = sum(unigrams.values())
-    unigram_tokens = list(unigrams.items())
-    for token, count in unigram_tokens:
-        distributions.probability[token] = count / total
-        distributions.information[token] = -math.log2(count / total)
-        logger.debug(
-            count,
-            distributions.probability[token],
-            distributions.information[token],
-            token,
-        )
+            ngram_tokens[ngram][predicted] = count
 
-    logger.info('Calculating probabilities and information content for ngram tokens')
+        logger.info('Calculating probabilities and information content for unigram tokens')
 
-    for token, outcomes in ngram_tokens.items():
-        logger.debug(f'Calculating for ngram token: {token}')
+        total = sum(unigrams.values())
+        unigram_tokens = list(unigrams.items())
+        for token, count in unigram_tokens:
+            distributions.probability[token] = count / total
+            distributions.information[token] = -math.log2(count / total)
 
-        total = sum(outcomes.values())
+        logger.info('Calculating probabilities and information content for ngram tokens')
 
-        # 10 is an arbitrary minimum number of samples
-        # to reduce overfitting paths based on a few samples
-        if total < 10:
-            logger.debug(f'Insufficient occurences of token {token}: {total}')
-            continue
+        pruned = 0
+        for token, outcomes in ngram_tokens.items():
+            total = sum(outcomes.values())
 
-        predicted = list(outcomes.items())
-        for predicted_token, count in predicted:
-            logger.debug(f'{count} occurences of {predicted_token}')
-            logger.debug(f'Calculating probability of {predicted_token} given token')
+            if total < MIN_NGRAM_SAMPLES:
+                pruned += 1
+                continue
 
-            distributions.probability[(*token, predicted_token)] = count / total
-            distributions.information[(*token, predicted_token)] = -math.log2(count / total)
+            predicted = list(outcomes.items())
+            for predicted_token, count in predicted:
+                distributions.probability[(*token, predicted_token)] = count / total
+                distributions.information[(*token, predicted_token)] = -math.log2(count / total)
 
-            logger.debug(
-                f'Distributions for token {(*token, predicted_token)} ({count})',
-                distributions.probability[(*token, predicted_token)],
-                distributions.information[(*token, predicted_token)],
-            )
+        if METRICS.enabled:
+            METRICS.increment('ngram_tokens_pruned', pruned)
+            METRICS.increment('distribution_tokens', len(distributions.probability))
 
     logger.info('Completed generating token distributions')
 
@@ -131,9 +122,15 @@ def _generate_next_tokens(
     information=0,
     information_values=[],
     token_probability,
-    token_information,
+    cache,
 ):
+    """
+    Recursively generates every token path for the rest of a build, returning
+    the paths and the number of branches pruned, which are counted locally
+    and recorded once by the caller rather than for each branch
+    """
     all_paths = []
+    pruned = 0
     # generate new path information for each possible new token
     for i in range(1, max_token_size + 1):
         updated_tokens = copy.copy(build_tokens)
@@ -144,67 +141,24 @@ def _generate_next_tokens(
 
         token = tuple(build[build_index:build_index + i])
 
-        logger.info(f'Generated new token of length {i} at index {build_index}: {token}')
-
         # if we don't have a record of the preceding sequence,
         # it was too unlikely to record so we bail
         if token not in token_probability:
-            logger.debug(f'Token probability not found: {token}')
+            pruned += 1
             continue
 
-        fragment_probability = 1
-        fragment_information = 0
-
-        fragment_probability_values = []
-        fragment_information_values = []
-
-        # start from full token and work backwards looking for cache hit
-        for index in range(len(token), 0, -1):
-            logger.info(f'At index {index} in token sequence')
-
-            token_fragment = token[:index]
-            logger.info(f'Current token fragment: {token_fragment}')
-
-            if (
-                token_fragment in CACHED_TOKEN_PROBABILITY
-                and token_fragment in CACHED_TOKEN_INFORMATION
-            ):
-                fragment_probability *= CACHED_TOKEN_PROBABILITY[token_fragment]
-                fragment_information += CACHED_TOKEN_INFORMATION[token_fragment]
-
-                fragment_probability_values.extend(CACHED_PROBABILITY_VALUES[token_fragment])
-                fragment_information_values.extend(CACHED_INFORMATION_VALUES[token_fragment])
-                break
-
-            fragment_probability *= token_probability[token_fragment]
-            fragment_probability_values.append(
-                token_probability[token_fragment]
-            )
-
-            fragment_information += token_information[token_fragment]
-            fragment_information_values.append(
-                token_information[token_fragment]
-            )
-
-        if (
-            token not in CACHED_TOKEN_PROBABILITY
-            or token not in CACHED_TOKEN_INFORMATION
-        ):
-            CACHED_TOKEN_PROBABILITY[token] = fragment_probability
-            CACHED_TOKEN_INFORMATION[token] = fragment_information
-
-        if (
-            token not in CACHED_PROBABILITY_VALUES
-            or token not in CACHED_INFORMATION_VALUES
-        ):
-            CACHED_PROBABILITY_VALUES[token] = fragment_probability_values[::-1]
-            CACHED_INFORMATION_VALUES[token] = fragment_information_values[::-1]
+        (
+            fragment_probability,
+            fragment_information,
+            fragment_probability_values,
+            fragment_information_values,
+        ) = cache.fragment(token)
 
         updated_probability *= fragment_probability
         updated_information += fragment_information
 
-        updated_probability_values.extend(fragment_probability_values[::-1])
-        updated_information_values.extend(fragment_information_values[::-1])
+        updated_probability_values.extend(fragment_probability_values)
+        updated_information_values.extend(fragment_information_values)
 
         updated_tokens.append(token)
 
@@ -222,7 +176,7 @@ def _generate_next_tokens(
             ))
             break
 
-        calculated_paths = _generate_next_tokens(
+        calculated_paths, calculated_pruned = _generate_next_tokens(
             race,
             player,
             max_collection_rate,
@@ -234,23 +188,26 @@ def _generate_next_tokens(
             information=updated_information,
             information_values=updated_information_values,
             token_probability=token_probability,
-            token_information=token_information
+            cache=cache,
         )
         all_paths.extend(calculated_paths)
+        pruned += calculated_pruned
 
-    return all_paths
+    return all_paths, pruned
 
 
-def generate_token_paths(
-    build,
+def _select_distributions(
     player_race,
     opp_race,
-    player_name,
-    max_collection_rate,
-    token_probability=TOKEN_PROBABILITY,
-    token_information=TOKEN_INFORMATION,
+    token_probability,
+    token_information,
 ):
-    logger.info(f'Recursively generating all possible token paths for build: {build}')
+    # the default distributions are only loaded when they're first used
+    if token_probability is None:
+        token_probability = data.TOKEN_PROBABILITY
+
+    if token_information is None:
+        token_information = data.TOKEN_INFORMATION
 
     if player_race and opp_race:
         if (
@@ -267,17 +224,538 @@ def generate_token_paths(
             token_information = token_information[player_race][opp_race]
             logger.debug(f'Setting token information to {player_race} / {opp_race}')
 
+    return token_probability, token_information
+
+
+def create_fragment_cache(
+    player_race,
+    opp_race,
+    token_probability=None,
+    token_information=None,
+    *,
+    maxsize=4096,
+):
+    """
+    Creates a fragment cache for a matchup, which can be passed
+    to the path generation functions to share cached fragments
+    across builds from the same matchup
+    """
+    token_probability, token_information = _select_distributions(
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+    )
+
+    return FragmentCache(
+        token_probability,
+        token_information,
+        player_race=player_race,
+        opp_race=opp_race,
+        maxsize=maxsize,
+    )
+
+
+def _select_fragment_cache(
+    player_race,
+    opp_race,
+    token_probability,
+    token_information,
+    cache,
+):
+    if cache is None:
+        return create_fragment_cache(
+            player_race,
+            opp_race,
+            token_probability,
+            token_information,
+        )
+
+    token_probability, token_information = _select_distributions(
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+    )
+
+    if not cache.is_for(token_probability, token_information):
+        raise ValueError(
+            f'Fragment cache for {cache.player_race} / {cache.opp_race} '
+            f'cannot be used for {player_race} / {opp_race}'
+        )
+
+    return cache
+
+
+def generate_token_paths(
+    build,
+    player_race,
+    opp_race,
+    player_name,
+    max_collection_rate,
+    token_probability=None,
+    token_information=None,
+    *,
+    cache=None,
+):
+    logger.info('Recursively generating all possible token paths for build: %s', build)
+
+    cache = _select_fragment_cache(
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+        cache,
+    )
+
+    with METRICS.stage('generate_token_paths'):
+        buildings = list(map(lambda x: x[0], build))
+        paths, pruned = _generate_next_tokens(
+            player_race,
+            player_name,
+            max_collection_rate,
+            buildings,
+            token_probability=cache.token_probability,
+            cache=cache,
+        )
+
+        logger.info('Sorting token paths by overall conditional probability')
+        paths.sort(key=lambda path: path.probability, reverse=True)
+
+    cache.record_metrics()
+    if METRICS.enabled:
+        METRICS.increment('paths_explored', len(paths))
+        METRICS.increment('branches_pruned', pruned)
+
+    return paths
+
+
+def _generate_token_fragments(
+    buildings,
+    build_index,
+    *,
+    max_token_size,
+    cache,
+):
+    """
+    Yields the size and fragment values of every valid token
+    starting at build_index, shortest first
+    """
+    for i in range(1, min(max_token_size, len(buildings) - build_index) + 1):
+        token = tuple(buildings[build_index:build_index + i])
+
+        # longer tokens are only recorded when their prefix is,
+        # so there is nothing left to find past a missing token
+        if token not in cache.token_probability:
+            break
+
+        yield (i, *cache.fragment(token))
+
+
+def _generate_trie_fragments(
+    building_ids,
+    build_index,
+    *,
+    max_token_size,
+    trie,
+):
+    """
+    Yields the same fragments as _generate_token_fragments by walking
+    a compiled token trie, extending the previous token by one building
+    """
+    node = ROOT_NODE
+    fragment_probability = 1
+    fragment_information = 0
+    fragment_probability_values = ()
+    fragment_information_values = ()
+
+    for i in range(1, min(max_token_size, len(building_ids) - build_index) + 1):
+        node = trie.child(node, building_ids[build_index + i - 1])
+        if node == MISSING_NODE:
+            break
+
+        probability = trie.probability[node]
+        information = trie.information[node]
+        if math.isnan(probability):
+            break
+
+        fragment_probability *= probability
+        fragment_information += information
+        fragment_probability_values += (probability,)
+        fragment_information_values += (information,)
+
+        yield (
+            i,
+            fragment_probability,
+            fragment_information,
+            fragment_probability_values,
+            fragment_information_values,
+        )
+
+
+def _select_fragment_generator(
+    buildings,
+    player_race,
+    opp_race,
+    token_probability,
+    token_information,
+    *,
+    max_token_size,
+    cache,
+    model,
+):
+    """
+    Returns a function generating the fragments at an index of the build and
+    the fragment cache it uses, which is None for models. Both are None if
+    the model has no distributions for the matchup
+    """
+    if model is not None:
+        # like distributions without the matchup, no fragments can be generated
+        trie = model.trie(player_race, opp_race)
+        if trie is None:
+            return None, None
+
+        building_ids = model.vocabulary.encode(buildings)
+
+        def generate_trie_fragments(build_index):
+            return _generate_trie_fragments(
+                building_ids,
+                build_index,
+                max_token_size=max_token_size,
+                trie=trie,
+            )
+
+        return generate_trie_fragments, None
+
+    cache = _select_fragment_cache(
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+        cache,
+    )
+
+    def generate_token_fragments(build_index):
+        return _generate_token_fragments(
+            buildings,
+            build_index,
+            max_token_size=max_token_size,
+            cache=cache,
+        )
+
+    return generate_token_fragments, cache
+
+
+def _generate_suffix_probabilities(buildings, generate_fragments):
+    """
+    Calculates the probability of the most likely token path from
+    each index of the build to the end of the build.
+
+    Returns the best suffix probability and the fragments starting
+    at each index, with None marking indexes that cannot reach the end
+    """
+    suffix_probability = [None] * (len(buildings) + 1)
+    suffix_probability[-1] = 1
+    fragments = [None] * len(buildings)
+    pruned = 0
+
+    for build_index in range(len(buildings) - 1, -1, -1):
+        fragments[build_index] = list(generate_fragments(build_index))
+
+        for size, fragment_probability, *_ in fragments[build_index]:
+            next_probability = suffix_probability[build_index + size]
+            if next_probability is None:
+                pruned += 1
+                continue
+
+            # strict comparison keeps the shortest token on ties, which is
+            # the same path the exhaustive search would sort first
+            path_probability = fragment_probability * next_probability
+            if (
+                suffix_probability[build_index] is None
+                or path_probability > suffix_probability[build_index]
+            ):
+                suffix_probability[build_index] = path_probability
+
+    if METRICS.enabled:
+        METRICS.increment('fragments_explored', sum(map(len, fragments)))
+        METRICS.increment('branches_pruned', pruned)
+
+    return suffix_probability, fragments
+
+
+def _prepare_token_path_search(
+    build,
+    player_race,
+    opp_race,
+    token_probability,
+    token_information,
+    *,
+    max_token_size,
+    cache,
+    model,
+):
+    """
+    Generates the fragments and suffix probabilities the token path searches
+    share. Returns (buildings, suffix_probability, fragments), or None if
+    the build has no complete token path
+    """
     buildings = list(map(lambda x: x[0], build))
-    paths = _generate_next_tokens(
+    generate_fragments, cache = _select_fragment_generator(
+        buildings,
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+        max_token_size=max_token_size,
+        cache=cache,
+        model=model,
+    )
+    if generate_fragments is None:
+        logger.info(f'No token distributions for {player_race} / {opp_race} in model')
+        return None
+
+    suffix_probability, fragments = _generate_suffix_probabilities(
+        buildings,
+        generate_fragments,
+    )
+
+    # every fragment is looked up by now, so cache lookups are recorded once
+    if cache is not None:
+        cache.record_metrics()
+
+    if not buildings or suffix_probability[0] is None:
+        logger.info('No complete token path found for build')
+        return None
+
+    return buildings, suffix_probability, fragments
+
+
+def generate_optimal_token_path(
+    build,
+    player_race,
+    opp_race,
+    player_name,
+    max_collection_rate,
+    token_probability=None,
+    token_information=None,
+    *,
+    max_token_size=4,
+    cache=None,
+    model=None,
+):
+    """
+    Finds the most likely token path for a build using dynamic programming,
+    rather than generating and sorting every possible path.
+
+    If a compiled TokenModel is supplied, it is used
+    instead of the token distributions and cache.
+
+    Returns the same path generate_token_paths would sort first,
+    or None if the build cannot be tokenized
+    """
+    logger.info('Generating optimal token path for build: %s', build)
+
+    with METRICS.stage('generate_optimal_token_path'):
+        return _generate_optimal_token_path(
+            build,
+            player_race,
+            opp_race,
+            player_name,
+            max_collection_rate,
+            token_probability,
+            token_information,
+            max_token_size=max_token_size,
+            cache=cache,
+            model=model,
+        )
+
+
+def _generate_optimal_token_path(
+    build,
+    player_race,
+    opp_race,
+    player_name,
+    max_collection_rate,
+    token_probability,
+    token_information,
+    *,
+    max_token_size,
+    cache,
+    model,
+):
+    search = _prepare_token_path_search(
+        build,
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+        max_token_size=max_token_size,
+        cache=cache,
+        model=model,
+    )
+    if search is None:
+        return None
+    buildings, suffix_probability, fragments = search
+
+    path_fragments = []
+    build_index = 0
+    while build_index < len(buildings):
+        for fragment in fragments[build_index]:
+            size, fragment_probability, *_ = fragment
+            next_probability = suffix_probability[build_index + size]
+            if (
+                next_probability is not None
+                and fragment_probability * next_probability == suffix_probability[build_index]
+            ):
+                break
+
+        path_fragments.append((build_index, fragment))
+        build_index += size
+
+    if METRICS.enabled:
+        METRICS.increment('paths_explored')
+
+    return _create_token_path(
         player_race,
         player_name,
         max_collection_rate,
         buildings,
-        token_probability=token_probability,
-        token_information=token_information,
+        path_fragments,
     )
 
-    logger.info('Sorting token paths by overall conditional probability')
-    paths.sort(key=lambda path: path.probability, reverse=True)
 
-    return paths
+def iter_token_paths(
+    build,
+    player_race,
+    opp_race,
+    player_name,
+    max_collection_rate,
+    token_probability=None,
+    token_information=None,
+    *,
+    max_token_size=4,
+    top_k=None,
+    beam_width=None,
+    cache=None,
+    model=None,
+):
+    """
+    Lazily generates token paths in order of decreasing probability.
+
+    Partial paths are expanded best first, ranked by the probability of
+    their best possible completion. Since that is known exactly, paths
+    are completed in order and only the partial paths leading to the
+    top_k paths are ever expanded.
+
+    beam_width caps the number of partial paths kept at once, which
+    bounds memory but can skip paths after the first.
+
+    If a compiled TokenModel is supplied, it is used
+    instead of the token distributions and cache
+    """
+    logger.info('Lazily generating token paths for build: %s', build)
+
+    search = _prepare_token_path_search(
+        build,
+        player_race,
+        opp_race,
+        token_probability,
+        token_information,
+        max_token_size=max_token_size,
+        cache=cache,
+        model=model,
+    )
+    if search is None:
+        return
+    buildings, suffix_probability, fragments = search
+
+    # partial paths are stored as linked lists of fragments so that
+    # expanding a path doesn't copy its previous tokens
+    order = itertools.count()
+    frontier = [(-suffix_probability[0], next(order), 0, 1, None)]
+    path_count = 0
+    expanded = 0
+    pruned = 0
+
+    # recorded when the generator finishes or is closed early
+    try:
+        while frontier and (top_k is None or path_count < top_k):
+            _, _, build_index, probability, path_node = heapq.heappop(frontier)
+
+            if build_index == len(buildings):
+                path_fragments = []
+                while path_node:
+                    path_node, fragment_index, fragment = path_node
+                    path_fragments.append((fragment_index, fragment))
+
+                yield _create_token_path(
+                    player_race,
+                    player_name,
+                    max_collection_rate,
+                    buildings,
+                    path_fragments[::-1],
+                )
+                path_count += 1
+                continue
+
+            expanded += 1
+            for fragment in fragments[build_index]:
+                size, fragment_probability, *_ = fragment
+                next_probability = suffix_probability[build_index + size]
+                if next_probability is None:
+                    continue
+
+                updated_probability = probability * fragment_probability
+                heapq.heappush(frontier, (
+                    -(updated_probability * next_probability),
+                    next(order),
+                    build_index + size,
+                    updated_probability,
+                    (path_node, build_index, fragment),
+                ))
+
+            if beam_width is not None and len(frontier) > beam_width:
+                pruned += len(frontier) - beam_width
+
+                # a sorted list is a valid heap
+                frontier = heapq.nsmallest(beam_width, frontier)
+    finally:
+        if METRICS.enabled:
+            METRICS.increment('paths_explored', path_count)
+            METRICS.increment('partial_paths_expanded', expanded)
+            METRICS.increment('branches_pruned', pruned)
+
+
+def _create_token_path(
+    race,
+    player,
+    max_collection_rate,
+    buildings,
+    path_fragments,
+):
+    path = TokenizedBuild(
+        race,
+        player,
+        max_collection_rate,
+        [],
+        1,
+        [],
+        0,
+        [],
+    )
+
+    for build_index, (
+        size,
+        fragment_probability,
+        fragment_information,
+        fragment_probability_values,
+        fragment_information_values,
+    ) in path_fragments:
+        path.tokens.append(tuple(buildings[build_index:build_index + size]))
+        path.probability *= fragment_probability
+        path.probability_values.extend(fragment_probability_values)
+        path.information += fragment_information
+        path.information_values.extend(fragment_information_values)
+
+    return path
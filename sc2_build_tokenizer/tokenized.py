@@ -0,0 +1,275 @@
+import logging
+from array import array
+from dataclasses import dataclass
+
+from sc2_build_tokenizer.model import Vocabulary
+from sc2_build_tokenizer.columns import save_columns, load_columns
+from sc2_build_tokenizer.dataclasses import TokenizedBuild
+
+logger = logging.getLogger(__name__)
+
+TOKENIZED_MAGIC = b'SC2TOKR\x00'
+TOKENIZED_VERSION = 1
+
+
+@dataclass(frozen=True)
+class TokenizedView:
+    """
+    Row view of a tokenized build stored in a TokenizedCorpus. Building ids,
+    values and the buildings of each token are memoryviews of the corpus
+    arrays rather than copies
+    """
+    __slots__ = ('corpus', 'index')
+
+    corpus: 'TokenizedCorpus'
+    index: int
+
+    @property
+    def race(self):
+        return self.corpus.races.names[self.corpus.race_ids[self.index]]
+
+    @property
+    def player(self):
+        return self.corpus.players.names[self.corpus.player_ids[self.index]]
+
+    @property
+    def max_collection_rate(self):
+        return self.corpus.max_collection_rates[self.index]
+
+    @property
+    def probability(self):
+        return self.corpus.probability[self.index]
+
+    @property
+    def information(self):
+        return self.corpus.information[self.index]
+
+    def _bounds(self):
+        token_start = self.corpus.build_token_offsets[self.index]
+        token_end = self.corpus.build_token_offsets[self.index + 1]
+        return (
+            token_start,
+            token_end,
+            self.corpus.token_offsets[token_start],
+            self.corpus.token_offsets[token_end],
+        )
+
+    @property
+    def building_ids(self):
+        _, _, start, end = self._bounds()
+        return memoryview(self.corpus.building_ids)[start:end]
+
+    @property
+    def probability_values(self):
+        _, _, start, end = self._bounds()
+        return memoryview(self.corpus.probability_values)[start:end]
+
+    @property
+    def information_values(self):
+        _, _, start, end = self._bounds()
+        return memoryview(self.corpus.information_values)[start:end]
+
+    @property
+    def token_ids(self):
+        """
+        The building ids of each token
+        """
+        token_start, token_end, _, _ = self._bounds()
+        building_ids = memoryview(self.corpus.building_ids)
+        token_offsets = self.corpus.token_offsets
+        return [
+            building_ids[token_offsets[token]:token_offsets[token + 1]]
+            for token in range(token_start, token_end)
+        ]
+
+    @property
+    def tokens(self):
+        return [self.corpus.vocabulary.decode(token) for token in self.token_ids]
+
+    def __len__(self):
+        token_start, token_end, _, _ = self._bounds()
+        return token_end - token_start
+
+    def to_tokenized_build(self):
+        return TokenizedBuild(
+            self.race,
+            self.player,
+            self.max_collection_rate,
+            self.tokens,
+            self.probability,
+            self.probability_values.tolist(),
+            self.information,
+            self.information_values.tolist(),
+        )
+
+
+class TokenizedCorpus:
+    """
+    Columnar store of tokenized builds.
+
+    The buildings of every token are interned as ids and stored in a flat
+    array alongside their probability and information values, with token t
+    from token_offsets[t] to token_offsets[t + 1]. The tokens of build i are
+    from build_token_offsets[i] to build_token_offsets[i + 1], and games
+    are stored as offsets into the builds.
+
+    Builds which couldn't be tokenized are stored without tokens
+    and converted back to None
+    """
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else Vocabulary()
+        self.races = Vocabulary()
+        self.players = Vocabulary()
+
+        self.building_ids = array('i')
+        self.probability_values = array('d')
+        self.information_values = array('d')
+        self.token_offsets = array('q', [0])
+        self.build_token_offsets = array('q', [0])
+        self.game_offsets = array('q', [0])
+
+        self.race_ids = array('b')
+        self.player_ids = array('i')
+        self.max_collection_rates = array('i')
+        self.probability = array('d')
+        self.information = array('d')
+        self.tokenized = array('b')
+
+    def __len__(self):
+        return len(self.build_token_offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f'Build index out of range: {index}')
+        if not self.tokenized[index]:
+            return None
+        return TokenizedView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def game_count(self):
+        return len(self.game_offsets) - 1
+
+    def _columns(self):
+        return {
+            'building_ids': self.building_ids,
+            'probability_values': self.probability_values,
+            'information_values': self.information_values,
+            'token_offsets': self.token_offsets,
+            'build_token_offsets': self.build_token_offsets,
+            'game_offsets': self.game_offsets,
+            'race_ids': self.race_ids,
+            'player_ids': self.player_ids,
+            'max_collection_rates': self.max_collection_rates,
+            'probability': self.probability,
+            'information': self.information,
+            'tokenized': self.tokenized,
+        }
+
+    @property
+    def nbytes(self):
+        """
+        Size of the corpus arrays in bytes, not including vocabularies
+        """
+        return sum(column.itemsize * len(column) for column in self._columns().values())
+
+    @classmethod
+    def from_games(cls, games, vocabulary=None):
+        """
+        Creates a corpus from games of TokenizedBuilds like tokenize_games
+        returns, or of dicts in the format of TokenizedBuild.to_json
+        """
+        corpus = cls(vocabulary)
+        for game in games:
+            corpus.append_game(game)
+        logger.info(f'Created corpus of {len(corpus)} tokenized builds from {corpus.game_count} games')
+        return corpus
+
+    def append_game(self, game):
+        """
+        Adds the tokenized builds of a game to the corpus. Builds are
+        only added as part of a game, so every build belongs to one
+        """
+        for tokenized_build in game:
+            self._append_build(tokenized_build)
+        self.game_offsets.append(len(self))
+
+    def _append_build(self, tokenized_build):
+        if tokenized_build is None:
+            self.build_token_offsets.append(len(self.token_offsets) - 1)
+            self.race_ids.append(-1)
+            self.player_ids.append(-1)
+            self.max_collection_rates.append(0)
+            self.probability.append(0)
+            self.information.append(0)
+            self.tokenized.append(False)
+            return
+
+        if isinstance(tokenized_build, dict):
+            tokenized_build = TokenizedBuild(**tokenized_build)
+
+        for token in tokenized_build.tokens:
+            self.building_ids.extend(map(self.vocabulary.intern, token))
+            self.token_offsets.append(len(self.building_ids))
+        self.probability_values.extend(tokenized_build.probability_values)
+        self.information_values.extend(tokenized_build.information_values)
+        self.build_token_offsets.append(len(self.token_offsets) - 1)
+
+        self.race_ids.append(self.races.intern(tokenized_build.race))
+        self.player_ids.append(self.players.intern(tokenized_build.player))
+        self.max_collection_rates.append(tokenized_build.max_collection_rate)
+        self.probability.append(tokenized_build.probability)
+        self.information.append(tokenized_build.information)
+        self.tokenized.append(True)
+
+    def game(self, index):
+        return [
+            self[build_index]
+            for build_index in range(self.game_offsets[index], self.game_offsets[index + 1])
+        ]
+
+    def games(self):
+        for index in range(self.game_count):
+            yield self.game(index)
+
+    def to_games(self):
+        """
+        Lazily converts each game back into a list of TokenizedBuilds
+        """
+        for game in self.games():
+            yield [
+                tokenized_build.to_tokenized_build() if tokenized_build is not None else None
+                for tokenized_build in game
+            ]
+
+    def save(self, path):
+        logger.info(f'Saving {len(self)} tokenized builds: {path}')
+        save_columns(
+            path,
+            TOKENIZED_MAGIC,
+            TOKENIZED_VERSION,
+            {
+                'buildings': self.vocabulary,
+                'races': self.races,
+                'players': self.players,
+            },
+            self._columns(),
+        )
+
+    @classmethod
+    def load(cls, path):
+        logger.info(f'Loading tokenized builds: {path}')
+        vocabularies, columns = load_columns(path, TOKENIZED_MAGIC, TOKENIZED_VERSION)
+
+        corpus = cls(vocabularies['buildings'])
+        corpus.races = vocabularies['races']
+        corpus.players = vocabularies['players']
+        for name, column in columns.items():
+            setattr(corpus, name, column)
+        return corpus